@@ -0,0 +1,46 @@
+"""Compare the throughput of the hash algorithms that track can use
+
+Usage::
+
+    python benchmarks/algorithms.py --size 256
+
+Size is in MiB.
+Data is hashed from memory so this measures only the cost of the algorithm.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from lazylfs import content
+
+_MiB = 1024 * 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--block-size", type=int, default=_MiB)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = memoryview(os.urandom(args.size * _MiB))
+    results = []
+    for name, algorithm in sorted(content.ALGORITHMS.items()):
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            h = algorithm()
+            for offset in range(0, len(data), args.block_size):
+                h.update(data[offset : offset + args.block_size])
+            h.hexdigest()
+            durations.append(time.perf_counter() - start)
+        results.append(
+            {"algorithm": name, "mib_per_second": args.size / min(durations)}
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare creating links per file, as before, and per directory
+
+Usage::
+
+    python benchmarks/link_bulk.py --dirs 1000 --files 100 --jobs 1 4
+
+The per file implementation is the one that was used before directories were
+created once each and links were created before checking for existing ones.
+Every implementation is timed both on an empty destination and on one where all
+links already exist.
+"""
+
+import argparse
+import json
+import pathlib
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from lazylfs import location, pathutils
+
+
+def _create_tree(top: pathlib.Path, num_dirs: int, num_files: int) -> None:
+    for i in range(num_dirs):
+        directory = top / f"d{i % 10}" / f"d{i}"
+        directory.mkdir(parents=True)
+        for j in range(num_files):
+            (directory / f"f{j}").touch()
+
+
+def _link_per_file(src: pathlib.Path, dst: pathlib.Path) -> None:
+    src_tails = {pathlib.Path(path) for path in location._find(src, ["**/*"])}
+    dst.mkdir(exist_ok=True)
+    for tail in sorted(src_tails):
+        dst_path = dst / tail
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        pathutils.ensure_lnk(dst_path, src / tail)
+
+
+def _measure(link: Callable[[pathlib.Path, pathlib.Path], None], src, dst) -> Dict:
+    result = {}
+    for state in ["empty", "existing"]:
+        start = time.perf_counter()
+        link(src, dst)
+        result[f"{state}_seconds"] = time.perf_counter() - start
+    shutil.rmtree(dst)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dirs", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        src = pathlib.Path(tmp, "src")
+        dst = pathlib.Path(tmp, "dst")
+        _create_tree(src, args.dirs, args.files)
+
+        results.append({"method": "per_file", **_measure(_link_per_file, src, dst)})
+        for jobs in args.jobs:
+
+            def _link_per_directory(src, dst):
+                location.link(src, dst, ["**/*"], jobs=jobs)
+
+            measurement = _measure(_link_per_directory, src, dst)
+            results.append({"method": "per_directory", "jobs": jobs, **measurement})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare traversals and wall time of matching link includes per pattern and at once
+
+Usage::
+
+    python benchmarks/link_patterns.py --dirs 200 --files 50
+
+The per pattern implementation is the one that was used before all patterns were
+compiled into a single matcher.
+Traversals are counted as directory listings using audit events, which requires
+Python 3.8 or later.
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Iterable, Iterator
+
+from lazylfs import location
+
+_SUFFIXES = [".wav", ".json", ".csv", ".txt"]
+_INCLUDES = ["**/*.wav", "**/*.json", "**/*.csv"]
+
+
+def _create_tree(top: pathlib.Path, num_dirs: int, num_files: int) -> None:
+    for i in range(num_dirs):
+        directory = top / f"d{i % 10}" / f"d{i}"
+        directory.mkdir(parents=True)
+        for j in range(num_files):
+            (directory / f"f{j}{_SUFFIXES[j % len(_SUFFIXES)]}").touch()
+
+
+def _find_per_pattern(top: pathlib.Path, includes: Iterable[str]) -> Iterator[str]:
+    for include in includes:
+        for path in top.glob(include):
+            if path.is_file() and not path.is_symlink():
+                yield str(path.relative_to(top))
+
+
+_listings = {"count": 0, "enabled": False}
+
+
+def _audit(event: str, args) -> None:
+    if _listings["enabled"] and event in ("os.scandir", "os.listdir"):
+        _listings["count"] += 1
+
+
+def _measure(find, top: pathlib.Path) -> dict:
+    _listings.update(count=0, enabled=True)
+    start = time.perf_counter()
+    num_files = len(set(find(top, _INCLUDES)))
+    duration = time.perf_counter() - start
+    _listings["enabled"] = False
+    return {"files": num_files, "listings": _listings["count"], "seconds": duration}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dirs", type=int, default=200)
+    parser.add_argument("--files", type=int, default=50)
+    args = parser.parse_args()
+    sys.addaudithook(_audit)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        top = pathlib.Path(tmp)
+        _create_tree(top, args.dirs, args.files)
+        results = {
+            "per_pattern": _measure(_find_per_pattern, top),
+            "single_pass": _measure(location._find, top),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Compare page cache policies by hashing throughput and what they leave cached
+
+Usage::
+
+    python benchmarks/page_cache.py --working-set 256 --data 4096 --dir /scratch
+
+For every policy a working set, standing in for the data of co-located programs,
+is read into the page cache, then files that are not cached are hashed. Reported
+are the throughput of hashing and the fraction of pages of the working set, and of
+the hashed files, that are resident in the page cache afterwards, as reported by
+mincore(2).
+The working set is only pushed out when the hashed files do not fit in the memory
+that is available besides it, so either hash more data than there is free memory
+or run the benchmark in a cgroup with a memory limit.
+Use ``--dir`` to benchmark a filesystem other than the one of the temporary
+directory; O_DIRECT is not supported by every filesystem, in which case the
+``direct`` policy falls back to ``drop``.
+"""
+
+import argparse
+import ctypes
+import json
+import mmap
+import os
+import pathlib
+import tempfile
+import time
+from typing import Dict, List
+
+from lazylfs import content, readers
+
+_MiB = 1024 * 1024
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+
+
+def _write(path: pathlib.Path, size: int) -> None:
+    with path.open("wb") as f:
+        for offset in range(0, size, _MiB):
+            f.write(os.urandom(min(_MiB, size - offset)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _evict(path: pathlib.Path) -> None:
+    # Works for clean pages without privileges, unlike dropping all caches
+    with path.open("rb") as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _warm(path: pathlib.Path) -> None:
+    with path.open("rb", buffering=0) as f:
+        while f.read(_MiB):
+            pass
+
+
+def _num_resident_pages(path: pathlib.Path) -> int:
+    size = path.stat().st_size
+    if not size:
+        return 0
+    num_pages = -(-size // mmap.PAGESIZE)
+    vec = (ctypes.c_ubyte * num_pages)()
+    # A private mapping is writable, as ctypes requires, without touching the pages
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) as mm:
+        start = ctypes.c_char.from_buffer(mm)
+        try:
+            if _libc.mincore(ctypes.addressof(start), size, vec):
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+        finally:
+            del start
+    return sum(page & 1 for page in vec)
+
+
+def _resident_fraction(paths: List[pathlib.Path]) -> float:
+    num_pages = sum(-(-path.stat().st_size // mmap.PAGESIZE) for path in paths)
+    return sum(map(_num_resident_pages, paths)) / num_pages
+
+
+def _measure(
+    policy: str,
+    working_set: pathlib.Path,
+    data: List[pathlib.Path],
+    block_size: int,
+) -> Dict:
+    for path in data:
+        _evict(path)
+    _warm(working_set)
+    before = _resident_fraction([working_set])
+
+    start = time.perf_counter()
+    for path in data:
+        content._hexdigest(path, "sha256", "auto", block_size, policy)
+    seconds = time.perf_counter() - start
+
+    num_bytes = sum(path.stat().st_size for path in data)
+    return {
+        "policy": policy,
+        "seconds": seconds,
+        "mb_per_second": num_bytes / 1e6 / seconds,
+        "working_set_resident_before": before,
+        "working_set_resident_after": _resident_fraction([working_set]),
+        "data_resident_after": _resident_fraction(data),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--working-set", type=int, default=256, help="MiB")
+    parser.add_argument("--data", type=int, default=1024, help="MiB")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--block-size", type=int, default=readers.DEFAULT_BLOCK_SIZE)
+    parser.add_argument(
+        "--policies",
+        nargs="+",
+        choices=readers.PAGE_CACHE_POLICIES,
+        default=list(readers.PAGE_CACHE_POLICIES),
+    )
+    parser.add_argument("--dir", type=pathlib.Path)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        working_set = pathlib.Path(tmp, "working_set")
+        _write(working_set, args.working_set * _MiB)
+        data = [pathlib.Path(tmp, f"f{i}") for i in range(args.files)]
+        for path in data:
+            _write(path, args.data * _MiB // args.files)
+
+        for policy in args.policies:
+            results.append(_measure(policy, working_set, data, args.block_size))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
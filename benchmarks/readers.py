@@ -0,0 +1,75 @@
+"""Compare the throughput of hashing files using different read strategies
+
+Usage::
+
+    python benchmarks/readers.py --sizes 1 64 512 --dir /path/on/filesystem/to/test
+
+Sizes are in MiB.
+Files are written right before being read so, unless they are larger than the page
+cache, this measures reading from memory rather than from storage.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+
+from lazylfs import readers
+
+_MiB = 1024 * 1024
+
+_CONFIGURATIONS = [
+    ("readinto", 64 * 1024),
+    ("readinto", 128 * 1024),
+    ("readinto", 1 * _MiB),
+    ("readinto", 4 * _MiB),
+    ("mmap", 1 * _MiB),
+    ("mmap", 16 * _MiB),
+    ("auto", None),
+]
+
+
+def _hash(path: pathlib.Path, strategy: str, block_size) -> float:
+    start = time.perf_counter()
+    h = hashlib.sha256()
+    with path.open("rb", buffering=0) as f:
+        for block in readers.read(f, strategy, block_size):
+            h.update(block)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 64, 256])
+    parser.add_argument("--dir", type=pathlib.Path, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for size in args.sizes:
+            path = pathlib.Path(tmp, f"{size}MiB")
+            with path.open("wb") as f:
+                for _ in range(size):
+                    f.write(os.urandom(_MiB))
+
+            for strategy, block_size in _CONFIGURATIONS:
+                duration = min(
+                    _hash(path, strategy, block_size) for _ in range(args.repeat)
+                )
+                results.append(
+                    {
+                        "size_mib": size,
+                        "strategy": strategy,
+                        "block_size": block_size,
+                        "mib_per_second": size / duration,
+                    }
+                )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
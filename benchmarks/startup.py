@@ -0,0 +1,89 @@
+"""Time the startup of the command line interface, as run from git hooks
+
+Usage::
+
+    python benchmarks/startup.py --repeat 20
+
+A file in a fresh repo is checked, once tracked, using the command line parser of
+lazylfs and, for comparison, using fire like before. The interpreter alone is
+timed too since on most machines it accounts for much of the total.
+Also reported are the import times of the modules of lazylfs, as reported by
+``python -X importtime``, for the lazylfs parser.
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from lazylfs import cli
+
+_LAZYLFS = "import sys; from lazylfs import cli; cli.main(sys.argv[1:])"
+_FIRE = "import sys, fire; from lazylfs import cli; fire.Fire(cli._COMMANDS)"
+
+
+def _median_seconds(command: List[str], repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def _import_times(args: List[str]) -> Dict[str, int]:
+    """Return the cumulative import time, in microseconds, of modules of lazylfs"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _LAZYLFS, *args],
+        check=True,
+        stderr=subprocess.PIPE,
+        text=True,
+    ).stderr
+    result = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name.startswith("lazylfs"):
+            result[name] = int(cumulative)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = pathlib.Path(tmp, "repo")
+        (repo / ".git").mkdir(parents=True)
+        target = pathlib.Path(tmp, "data")
+        target.write_bytes(b"data")
+        (repo / "data").symlink_to(target)
+        cli.track(str(repo), progress=False)
+
+        check = ["check", str(repo / "data")]
+        results = {
+            "interpreter_seconds": _median_seconds(
+                [sys.executable, "-c", "pass"], args.repeat
+            ),
+            "lazylfs_seconds": _median_seconds(
+                [sys.executable, "-c", _LAZYLFS, *check], args.repeat
+            ),
+            "fire_seconds": _median_seconds(
+                [sys.executable, "-c", _FIRE, *check], args.repeat
+            ),
+            "import_microseconds": _import_times(check),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Time link, track and check on synthetic trees of different shapes
+
+Usage::
+
+    python benchmarks/suite.py --scale 1 --output results.json
+
+Every command runs in a fresh interpreter so that its peak RSS is not inflated by
+earlier commands and so that no state is shared between commands, except for the
+page cache.
+The scale multiplies the number of files, and the size of huge files, in every
+shape; results are only comparable between runs with the same scale.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import lazylfs
+from lazylfs import cli
+
+_KiB = 1024
+_MiB = 1024 * _KiB
+
+_COMMANDS = ["link", "track", "check"]
+
+
+def _write(path: pathlib.Path, size: int) -> None:
+    with path.open("wb") as f:
+        for offset in range(0, size, _MiB):
+            f.write(os.urandom(min(_MiB, size - offset)))
+
+
+def _many_small(top: pathlib.Path, scale: float) -> None:
+    for i in range(int(20_000 * scale)):
+        directory = top / f"d{i % 100}"
+        directory.mkdir(parents=True, exist_ok=True)
+        _write(directory / f"f{i}", 4 * _KiB)
+
+
+def _few_huge(top: pathlib.Path, scale: float) -> None:
+    top.mkdir(parents=True)
+    for i in range(4):
+        _write(top / f"f{i}", int(256 * _MiB * scale))
+
+
+def _deep(top: pathlib.Path, scale: float) -> None:
+    directory = top
+    for i in range(int(200 * scale)):
+        directory = directory / f"d{i}"
+        directory.mkdir(parents=True)
+        for j in range(10):
+            _write(directory / f"f{j}", 1 * _KiB)
+
+
+def _wide(top: pathlib.Path, scale: float) -> None:
+    # A single directory, and so a single large index
+    top.mkdir(parents=True)
+    for i in range(int(50_000 * scale)):
+        _write(top / f"f{i}", 1 * _KiB)
+
+
+_SHAPES: Dict[str, Callable[[pathlib.Path, float], None]] = {
+    "many_small": _many_small,
+    "few_huge": _few_huge,
+    "deep": _deep,
+    "wide": _wide,
+}
+
+
+def _size_of_files(top: pathlib.Path) -> Dict[str, int]:
+    num_files = num_bytes = 0
+    for directory, _, names in os.walk(top):
+        for name in names:
+            num_files += 1
+            num_bytes += os.path.getsize(os.path.join(directory, name))
+    return {"files": num_files, "bytes": num_bytes}
+
+
+def _run_command(command: str, src: pathlib.Path, repo: pathlib.Path) -> None:
+    """Run one command in this process and print its duration and peak RSS"""
+    start = time.perf_counter()
+    if command == "link":
+        cli.link(src, repo / "data")
+    elif command == "track":
+        cli.track(repo / "data")
+    elif command == "check":
+        cli.check(repo / "data")
+    else:
+        raise ValueError(f"Unknown command {command!r}")
+    duration = time.perf_counter() - start
+    # Kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _KiB
+    print(json.dumps({"seconds": duration, "peak_rss_bytes": peak_rss}))
+
+
+def _measure(command: str, src: pathlib.Path, repo: pathlib.Path) -> Dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--run", command, str(src), str(repo)],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def _benchmark_shape(name: str, scale: float, tmp: pathlib.Path) -> List[Dict]:
+    src = tmp / name / "src"
+    repo = tmp / name / "repo"
+    _SHAPES[name](src, scale)
+    (repo / ".git").mkdir(parents=True)
+    size = _size_of_files(src)
+
+    results = []
+    for command in _COMMANDS:
+        measurement = _measure(command, src, repo)
+        seconds = measurement["seconds"]
+        results.append(
+            {
+                "shape": name,
+                "command": command,
+                **size,
+                **measurement,
+                "files_per_second": size["files"] / seconds,
+                # Link does not read the content of files
+                "mb_per_second": (
+                    None if command == "link" else size["bytes"] / 1e6 / seconds
+                ),
+            }
+        )
+    return results
+
+
+def main() -> None:
+    if sys.argv[1:2] == ["--run"]:
+        command, src, repo = sys.argv[2:]
+        _run_command(command, pathlib.Path(src), pathlib.Path(repo))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--shapes", nargs="+", choices=sorted(_SHAPES))
+    parser.add_argument("--output", type=pathlib.Path)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.shapes or list(_SHAPES):
+            results.extend(_benchmark_shape(name, args.scale, pathlib.Path(tmp)))
+
+    report = json.dumps(
+        {
+            "lazylfs": lazylfs.__version__,
+            "python": platform.python_version(),
+            "scale": args.scale,
+            "results": results,
+        },
+        indent=2,
+    )
+    if args.output is None:
+        print(report)
+    else:
+        args.output.write_text(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
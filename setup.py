@@ -40,5 +40,5 @@ setuptools.setup(
     install_requires=_read_requirements("install_requires"),
     extras_require={"cli": _read_requirements("extras_require-cli")},
     package_dir={"": "src"},
-    entry_points={"console_scripts": ["lazylfs = lazylfs.cli:main [cli]"]},
+    entry_points={"console_scripts": ["lazylfs = lazylfs.cli:main"]},
 )
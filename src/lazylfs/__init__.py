@@ -1,3 +1,9 @@
-from lazylfs import version
-
-__version__ = version.__version__
+def __getattr__(name: str) -> str:
+    # Read when needed since importing importlib.metadata slows down every command
+    if name != "__version__":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        from importlib import metadata
+    except ImportError:  # Python < 3.8
+        import importlib_metadata as metadata  # type: ignore
+    return metadata.version(__name__)
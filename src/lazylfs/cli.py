@@ -1,18 +1,28 @@
 from __future__ import annotations
 
+import contextlib
 import logging
 import os
 import pathlib
 import sys
 from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
     Union,
     TYPE_CHECKING,
     Set,
+    Sequence,
     Tuple,
+    Iterable,
     Iterator,
+    Optional,
 )
 
-from lazylfs import content, location
+# Modules needed only by some commands, or options, are imported where they are used
+# so that commands run from hooks, many times over, start quickly.
+from lazylfs import content, metrics, walk
 
 _logger = logging.getLogger(__name__)
 
@@ -20,54 +30,651 @@ if TYPE_CHECKING:
     PathT = Union[str, os.PathLike[str], pathlib.Path]
 
 
-def _collect_paths(includes: Tuple[str, ...]) -> Set[pathlib.Path]:
-    if not includes:
-        includes = tuple([line.rstrip() for line in sys.stdin.readlines()])
+def _as_tuple(value: Union[str, Sequence[str]]) -> Tuple[str, ...]:
+    # Fire passes a single value as a plain string
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
 
-    included: Set[pathlib.Path] = set()
-    for top in includes:
-        included.update(_find(pathlib.Path(top)))
-    return included
 
+@contextlib.contextmanager
+def _reporting_stats(style: Union[bool, str]) -> Iterator[None]:
+    """Collect metrics while in the context and print them to stderr when leaving
 
-def _find(top: pathlib.Path) -> Iterator[pathlib.Path]:
-    yield top
-    yield from top.rglob("*")
+    :param style: ``False`` to not collect metrics, ``True`` for the default style
+        or a style accepted by :py:func:`metrics.render`
+    """
+    if not style:
+        yield
+        return
+
+    metrics.enable()
+    try:
+        with metrics.timer("total"):
+            yield
+    finally:
+        metrics.disable()
+        rendered = metrics.render(
+            metrics.summary(), "text" if style is True else str(style)
+        )
+        print(rendered, file=sys.stderr)
+
+
+def _collect_paths(
+    includes: Tuple[str, ...],
+    excludes: Sequence[str] = (),
+    since: Optional[str] = None,
+) -> Iterable[walk.Entry]:
+    if since is not None:
+        entries = _find_changed(
+            (pathlib.Path(top).absolute() for top in includes or (".",)),
+            since,
+            excludes,
+        )
+    else:
+        if includes:
+            tops: Iterable[str] = includes
+        else:
+            tops = (line.rstrip() for line in sys.stdin)
+        entries = _find_all((pathlib.Path(top) for top in tops), excludes)
+    return metrics.timed("walk", entries, "entries_walked")
+
+
+def _find_all(
+    tops: Iterable[pathlib.Path], excludes: Sequence[str] = ()
+) -> Iterator[walk.Entry]:
+    """Lazily yield all `tops` and their descendants, each at most once
+
+    Only the tops are remembered so memory use is proportional to the number of tops
+    rather than to the number of paths yielded.
+    """
+    visited: Set[pathlib.Path] = set()
+    visited_dirs: Set[pathlib.Path] = set()
+    for top in tops:
+        if top in visited or not visited_dirs.isdisjoint(top.parents):
+            continue
+
+        nested_dirs = {path for path in visited_dirs if top in path.parents}
+        visited.add(top)
+        if top.is_dir():
+            visited_dirs.add(top)
 
+        yield walk.Entry.from_path(top)
+        for entry in walk.walk(top, excludes):
+            path = entry.path
+            if path in visited:
+                continue
+            if nested_dirs and not nested_dirs.isdisjoint(path.parents):
+                continue
+            yield entry
 
-def link(src: PathT, dst: PathT, includes: Tuple[str, ...] = ("**/*",)) -> None:
+
+def _find_changed(
+    tops: Iterable[pathlib.Path], since: str, excludes: Sequence[str] = ()
+) -> Iterator[walk.Entry]:
+    """Lazily yield the paths under `tops` that git reports as changed since `since`
+
+    Changed indexes are replaced by the links whose entries changed so that the work
+    done is proportional to the size of the diff rather than that of the directory.
+    """
+    from lazylfs import gitutils
+
+    excluded = walk.Patterns(excludes)
+    visited: Set[pathlib.Path] = set()
+    for top in tops:
+        directory = top if top.is_dir() else top.parent
+        try:
+            changed = gitutils.changed_paths(directory, since)
+        except ValueError as e:
+            raise _UsageError(f"Invalid --since {since}: {e}") from None
+        for path in changed:
+            if path != top and top not in path.parents:
+                continue
+            # Like walk, skip paths under excluded directories too
+            parts = path.relative_to(directory).parts
+            ancestors = ("/".join(parts[: i + 1]) for i in range(len(parts)))
+            if any(walk.is_pruned(ancestor, excluded) for ancestor in ancestors):
+                continue
+
+            for affected in content.affected_paths(path, since):
+                if affected not in visited:
+                    visited.add(affected)
+                    yield walk.Entry.from_path(affected)
+
+
+def link(
+    src: PathT,
+    dst: PathT,
+    *includes: str,
+    excludes: Sequence[str] = (),
+    jobs: int = 1,
+    incremental: bool = False,
+    prune: bool = False,
+    stats: Union[bool, str] = False,
+) -> None:
     """Create links in `dst` to the corresponding files in `src`
 
     :param src: Directory under which to look for files
     :param dst: Directory under which to create symlinks
-    :param includes: List of glob patterns specifying what files to link.
+    :param includes: Glob patterns specifying what files to link.
         The default is to include everything.
         Files matched by none of the patterns will not be linked.
+    :param excludes: Glob patterns specifying what files not to link, matched
+        against their path relative to `src` like `includes`. Directories matching
+        any of the patterns are not searched.
+    :param jobs: Number of directories to create links in concurrently
+    :param incremental: Look for new files only in directories of `src` whose
+        modification time, or number of subdirectories, has changed since the last
+        incremental run with the same arguments. Links in `dst` whose target has
+        been removed are reported. Requires `dst` to be in a repo.
+    :param prune: Remove links whose target has been removed, and their index
+        entries, when incremental
+    :param stats: Print counters and timers to stderr when done; ``--stats=json``
+        prints them as JSON.
     """
+    from lazylfs import location
+
     src = pathlib.Path(src).resolve()
     dst = pathlib.Path(dst).resolve()
-    location.link(src, dst, includes)
+    with _reporting_stats(stats):
+        location.link(
+            src,
+            dst,
+            includes or ("**/*",),
+            _as_tuple(excludes),
+            jobs=jobs,
+            incremental=incremental,
+            prune=prune,
+        )
+
 
+def track(
+    *includes: str,
+    jobs: int = 1,
+    cache: bool = True,
+    trust_cache: bool = False,
+    excludes: Sequence[str] = (),
+    reader: str = "auto",
+    block_size: Optional[int] = None,
+    page_cache: str = "keep",
+    concurrency: Optional[int] = None,
+    algorithm: str = "sha256",
+    quick: bool = False,
+    since: Optional[str] = None,
+    stats: Union[bool, str] = False,
+    progress: bool = False,
+    database: bool = False,
+    resume: bool = False,
+) -> None:
+    """Track the checksum of files in the index
 
-def track(*includes: str,) -> None:
-    """Track the checksum of files in the index"""
-    content.track(_collect_paths(includes))
+    :param jobs: Number of files to hash concurrently
+    :param cache: Record checksums in a cache under the git directory of the repo.
+        Pass ``--no-cache`` to neither read nor write the cache.
+    :param trust_cache: Reuse checksums from the cache for files whose size, inode,
+        and modification and change times have not changed since they were recorded.
+    :param excludes: Glob patterns for files and directories to skip when walking
+        directories, matched against their path relative to the path given, like
+        for ``link``; ``**/tmp`` skips everything named ``tmp``. Directories named
+        ``.git`` are always skipped.
+    :param reader: How to read files; one of ``readinto``, ``mmap`` or ``auto`` to
+        choose a block size based on the size of the file and the type of its
+        filesystem. With ``mmap`` a file truncated while being hashed kills the
+        process, so ``auto`` never chooses it.
+    :param block_size: Number of bytes to read at a time
+    :param page_cache: How hashing should affect the page cache; ``keep`` files
+        cached like any other read, ``sequential`` also hints that files are read
+        sequentially, ``drop`` evicts files from the cache as they are hashed, so
+        that hashing does not evict the data of other programs, and ``direct``
+        bypasses the cache using ``O_DIRECT`` where the filesystem supports it.
+    :param concurrency: Hash files using asyncio with up to this many files per
+        mount being read at a time, instead of using ``jobs`` threads. Suitable for
+        network filesystems where every request has a high latency.
+    :param algorithm: Hash algorithm for new entries; one of ``sha256``, ``blake2b``
+        or ``blake2s``. Existing entries keep the algorithm they were tracked with.
+    :param quick: Also record a quick fingerprint, of the size and a few sampled
+        blocks, for every file so that it can be checked with ``check --quick``.
+        Indexes with quick fingerprints cannot be verified with ``sha256sum -c``.
+    :param since: Track only links that git reports as changed since this revision,
+        including untracked links. Paths default to the working directory.
+    :param stats: Print counters and timers to stderr when done; ``--stats=json``
+        prints them as JSON.
+    :param progress: Show files and bytes done, throughput and estimated time
+        remaining on stderr. This requires finding all paths, and the size of their
+        targets, before starting.
+    :param database: Mirror indexes in a database under the git directory of the
+        repo and read unchanged indexes from there, see ``query``.
+    :param resume: Continue a run that did not finish, reusing the checksums it
+        recorded for files that have not changed since. Runs that use the cache
+        record checksums in a journal as they go.
+    """
+    with _reporting_stats(stats):
+        content.track(
+            _collect_paths(includes, _as_tuple(excludes), since),
+            jobs=jobs,
+            cache=cache,
+            trust_cache=trust_cache,
+            reader=reader,
+            block_size=block_size,
+            page_cache=page_cache,
+            concurrency=concurrency,
+            algorithm=algorithm,
+            quick=quick,
+            show_progress=progress,
+            database=database,
+            resume=resume,
+        )
 
 
 NotOkError = content.NotOkError
 
 
-def check(*includes: str,) -> None:
+def _print_ndjson(path: pathlib.Path, reason: Optional[str]) -> None:
+    import json
+
+    status = "ok" if reason is None else "nok"
+    record = {"path": str(path), "status": status, "reason": reason}
+    print(json.dumps(record), flush=True)
+
+
+def check(
+    *includes: str,
+    jobs: int = 1,
+    cache: bool = True,
+    trust_cache: bool = False,
+    excludes: Sequence[str] = (),
+    reader: str = "auto",
+    block_size: Optional[int] = None,
+    page_cache: str = "keep",
+    concurrency: Optional[int] = None,
+    processes: Optional[int] = None,
+    quick: bool = False,
+    full: bool = False,
+    since: Optional[str] = None,
+    stats: Union[bool, str] = False,
+    progress: bool = False,
+    database: bool = False,
+    resume: bool = False,
+    fail_fast: bool = False,
+    ndjson: bool = False,
+) -> None:
     """Check the checksum of files against the index
 
     Exit with non-zero status if a difference is detected or a file could not be
     checked.
+
+    :param jobs: Number of files to hash concurrently
+    :param cache: Record checksums in a cache under the git directory of the repo.
+        Pass ``--no-cache`` to neither read nor write the cache.
+    :param trust_cache: Reuse checksums from the cache for files whose size, inode,
+        and modification and change times have not changed since they were recorded.
+    :param excludes: Glob patterns for files and directories to skip when walking
+        directories, matched against their path relative to the path given, like
+        for ``link``; ``**/tmp`` skips everything named ``tmp``. Directories named
+        ``.git`` are always skipped.
+    :param reader: How to read files; one of ``readinto``, ``mmap`` or ``auto`` to
+        choose a block size based on the size of the file and the type of its
+        filesystem. With ``mmap`` a file truncated while being hashed kills the
+        process, so ``auto`` never chooses it.
+    :param block_size: Number of bytes to read at a time
+    :param page_cache: How hashing should affect the page cache; ``keep`` files
+        cached like any other read, ``sequential`` also hints that files are read
+        sequentially, ``drop`` evicts files from the cache as they are hashed, so
+        that hashing does not evict the data of other programs, and ``direct``
+        bypasses the cache using ``O_DIRECT`` where the filesystem supports it.
+    :param concurrency: Hash files using asyncio with up to this many files per
+        mount being read at a time, instead of using ``jobs`` threads. Suitable for
+        network filesystems where every request has a high latency.
+    :param processes: Check paths in this many worker processes, instead of using
+        ``jobs`` threads. Suitable for many small files when a single core is the
+        bottleneck.
+    :param quick: Compare only the size and a few sampled blocks of files that were
+        tracked with ``--quick``. This catches truncated, extended and replaced
+        files but not changes elsewhere in a file; files without a quick
+        fingerprint, or whose quick fingerprint differs, are checked in full.
+    :param full: Check every file in full, even with ``--quick``, for instance when
+        a hook passes ``--quick``.
+    :param since: Check only links, and entries in indexes, that git reports as
+        changed since this revision, including untracked links. Paths default to
+        the working directory.
+    :param stats: Print counters and timers to stderr when done; ``--stats=json``
+        prints them as JSON.
+    :param progress: Show files and bytes done, throughput and estimated time
+        remaining on stderr. This requires finding all paths, and the size of their
+        targets, before starting.
+    :param database: Mirror indexes in a database under the git directory of the
+        repo and read unchanged indexes from there, see ``query``.
+    :param resume: Continue a run that did not finish, reusing the checksums it
+        recorded for files that have not changed since. Runs that use the cache
+        record checksums in a journal as they go.
+    :param fail_fast: Stop at the first path that is not OK instead of checking all
+        paths.
+    :param ndjson: Print one JSON object per path to stdout, as soon as it has been
+        checked, with the ``path``, its ``status``, ``ok`` or ``nok``, and the
+        ``reason`` that it is not OK; one of ``missing``, ``extra``, ``mismatch`` or
+        ``unreadable``.
+    """
+    with _reporting_stats(stats):
+        content.check(
+            _collect_paths(includes, _as_tuple(excludes), since),
+            jobs=jobs,
+            cache=cache,
+            trust_cache=trust_cache,
+            reader=reader,
+            block_size=block_size,
+            page_cache=page_cache,
+            concurrency=concurrency,
+            processes=processes,
+            quick=quick and not full,
+            show_progress=progress,
+            database=database,
+            resume=resume,
+            fail_fast=fail_fast,
+            on_result=_print_ndjson if ndjson else None,
+        )
+
+
+def query(
+    top: PathT = ".", under: PathT = "/", size: bool = False, sync: bool = False
+) -> None:
+    """Print the tracked links in `top` that point to files under `under`
+
+    Answers come from the database kept by ``track`` and ``check`` when given
+    ``--database``, after revalidating indexes that have changed since.
+    The ``.shasum`` files remain the source of truth.
+
+    :param top: Directory in a repo in which to look for links
+    :param under: Directory of the targets to look for
+    :param size: Print the total size of the distinct targets instead of the links
+    :param sync: Look for indexes not yet in the database, this walks all of `top`
     """
-    content.check(_collect_paths(includes))
+    top = pathlib.Path(top).absolute()
+    under = pathlib.Path(under).absolute()
+    links = content.query(top, under, sync)
+    if not size:
+        for link, _ in links:
+            print(link)
+        return
+
+    sizes = {}
+    for link, target in links:
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            _logger.warning("Target of %s is missing", link)
+            continue
+        sizes[st.st_dev, st.st_ino] = st.st_size
+    print(sum(sizes.values()))
+
+
+def serve(
+    framing: str = "pkt-line",
+    jobs: int = 1,
+    cache: bool = True,
+    trust_cache: bool = False,
+    excludes: Sequence[str] = (),
+    reader: str = "auto",
+    block_size: Optional[int] = None,
+    page_cache: str = "keep",
+    concurrency: Optional[int] = None,
+    algorithm: str = "sha256",
+    quick: bool = False,
+    database: bool = False,
+) -> None:
+    """Track and check paths as requested on stdin until it is closed
+
+    Parsed indexes and the checksums of files are kept between requests so that
+    clients, like hooks and editors, that make many small requests need not pay
+    for starting over every time. Checksums are reused while the size, inode, and
+    modification and change times of files are unchanged, except for files modified
+    shortly before a request. Indexes are reread when they have changed.
+
+    The protocol is described in :py:mod:`lazylfs.server`.
+
+    :param framing: ``pkt-line``, like the long running filter processes of git, or
+        ``newline`` for one request per line and one line of JSON per response.
+    :param jobs: Number of files to hash concurrently
+    :param cache: Record checksums in a cache under the git directory of the repo,
+        when the server exits. Pass ``--no-cache`` to neither read nor write it.
+    :param trust_cache: Reuse checksums from the cache for files whose size, inode,
+        and modification and change times have not changed since they were recorded.
+    :param excludes: Glob patterns for files and directories to skip when walking
+        directories, matched against their path relative to the path given, like
+        for ``link``; ``**/tmp`` skips everything named ``tmp``. Directories named
+        ``.git`` are always skipped.
+    :param reader: How to read files; one of ``readinto``, ``mmap`` or ``auto`` to
+        choose a block size based on the size of the file and the type of its
+        filesystem. With ``mmap`` a file truncated while being hashed kills the
+        process, so ``auto`` never chooses it.
+    :param block_size: Number of bytes to read at a time
+    :param page_cache: How hashing should affect the page cache, see ``check``.
+    :param concurrency: Hash files using asyncio with up to this many files per
+        mount being read at a time, instead of using ``jobs`` threads.
+    :param algorithm: Hash algorithm for new entries; one of ``sha256``, ``blake2b``
+        or ``blake2s``.
+    :param quick: Record quick fingerprints when tracking and compare only those,
+        where present, when checking. See ``check --quick``.
+    :param database: Mirror indexes in a database under the git directory of the
+        repo and read unchanged indexes from there, see ``query``.
+    """
+    from lazylfs import server
+
+    excludes = _as_tuple(excludes)
+    service = content.Service(
+        jobs,
+        concurrency,
+        cache=cache,
+        trust_cache=trust_cache,
+        reader=reader,
+        block_size=block_size,
+        page_cache=page_cache,
+        algorithm=algorithm,
+        quick=quick,
+        database=database,
+    )
 
+    def _handle(command: str, paths: Sequence[str]) -> server.Results:
+        entries = _find_all((pathlib.Path(path) for path in paths), excludes)
+        if command == "track":
+            service.track(entries)
+            return []
+        return [
+            (str(path), reason)
+            for path, reason in service.check(entries)
+            if reason is not None
+        ]
 
-def main():
-    import fire  # type: ignore
+    with service:
+        server.serve(_handle, sys.stdin.buffer, sys.stdout.buffer, framing)
 
+
+_COMMANDS: Dict[str, Callable[..., None]] = {
+    "link": link,
+    "track": track,
+    "check": check,
+    "query": query,
+    "serve": serve,
+}
+
+# Same as inspect.CO_VARARGS, inspect is slow to import
+_CO_VARARGS = 0x04
+
+_CONSTANTS = {"True": True, "False": False, "None": None}
+# Parameters that are only boolean, as opposed to for instance ``Union[bool, str]``
+_FLAG_ANNOTATIONS = ("bool", "Optional[bool]")
+
+
+class _UsageError(ValueError):
+    pass
+
+
+def _parse_value(text: str) -> Any:
+    """Parse `text` like fire would, for the types of values that commands take
+
+    >>> [_parse_value(text) for text in ["4", "True", "None", "json", "['.*']"]]
+    [4, True, None, 'json', ['.*']]
+    """
+    if text in _CONSTANTS:
+        return _CONSTANTS[text]
+    if text.startswith(("[", "(")) and text.endswith(("]", ")")):
+        return _parse_sequence(text)
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def _parse_sequence(text: str) -> Any:
+    # Imported here since lists are rarely given on the command line
+    import ast
+
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+    return list(value) if isinstance(value, (list, tuple)) else text
+
+
+def _as_values(text: str) -> List[str]:
+    """Return the positional arguments given by `text`, expanding any list"""
+    value = _parse_value(text)
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [text]
+
+
+def _parse_args(
+    func: Callable[..., None], args: Sequence[str]
+) -> Tuple[List[str], Dict[str, Any]]:
+    """Parse command line `args` into arguments for calling `func`
+
+    Accepts the same syntax as fire for the parameters of the commands;
+    ``--name=value`` and ``--name value`` for any parameter and ``--name`` and
+    ``--noname``, or ``--no-name``, for boolean parameters. Values may be lists
+    of quoted strings, like ``--excludes='["a", "b"]'``, and parameters that are
+    sequences may also be given more than once. Lists given as positional arguments,
+    or by the name of the variadic parameter, like ``--includes='["a", "b"]'``, are
+    expanded into the variadic arguments.
+    Unlike fire, parameters that are only boolean never take the following argument
+    as their value, so ``--quick a`` is the flag followed by the path ``a``.
+    Parameters that are boolean or strings, like ``--stats``, take the following
+    argument unless it starts with ``--``, like with fire.
+
+    >>> _parse_args(check, ["a", "--jobs", "4", "--nocache", "--excludes=.*", "b"])
+    (['a', 'b'], {'jobs': 4, 'cache': False, 'excludes': ['.*']})
+    >>> _parse_args(check, ["--stats", "json", "a", "--stats", "--quick", "b"])
+    (['a', 'b'], {'stats': True, 'quick': True})
+    >>> _parse_args(link, ["s", "--includes=['*.a']", "d", "['*.b', '*.c']"])
+    (['s', 'd', '*.b', '*.c', '*.a'], {})
+
+    :raises _UsageError: if `args` cannot be passed to `func`
+    """
+    code = func.__code__
+    positional = code.co_varnames[: code.co_argcount]
+    names = code.co_varnames[: code.co_argcount + code.co_kwonlyargcount]
+    annotations = {name: str(func.__annotations__.get(name)) for name in names}
+    booleans = {name for name in names if "bool" in annotations[name]}
+    flags = {name for name in booleans if annotations[name] in _FLAG_ANNOTATIONS}
+    sequences = {name for name in names if annotations[name].startswith("Sequence")}
+    is_variadic = bool(code.co_flags & _CO_VARARGS)
+    variadic = code.co_varnames[len(names)] if is_variadic else None
+
+    values: List[str] = []
+    # Variadic arguments given by name, passed after all positional arguments
+    named_values: List[str] = []
+    options: Dict[str, Any] = {}
+    tokens = list(args)
+    tokens.reverse()
+    while tokens:
+        token = tokens.pop()
+        if token == "--":
+            values.extend(reversed(tokens))
+            break
+        if not token.startswith("--"):
+            values.extend(_as_values(token))
+            continue
+
+        name, equals, text = token[2:].partition("=")
+        name = name.replace("-", "_")
+        # Both --nocache, like fire, and --no-cache
+        negated = name[2:].lstrip("_") if name.startswith("no") else None
+        if not equals and name not in names and negated in booleans:
+            options[negated] = False
+            continue
+        if name not in names and name != variadic:
+            raise _UsageError(f"Unknown option --{name}")
+        if not equals and not tokens and name not in booleans:
+            raise _UsageError(f"Option --{name} requires a value")
+        if name == variadic:
+            named_values.extend(_as_values(text if equals else tokens.pop()))
+            continue
+
+        if equals:
+            value = _parse_value(text)
+        elif name in flags:
+            value = True
+        elif name in booleans:
+            is_flag = not tokens or tokens[-1].startswith("--")
+            value = True if is_flag else _parse_value(tokens.pop())
+        else:
+            value = _parse_value(tokens.pop())
+
+        if name in sequences:
+            items = value if isinstance(value, list) else [value]
+            options.setdefault(name, []).extend(items)
+        else:
+            options[name] = value
+
+    if len(values) > len(positional) and not is_variadic:
+        raise _UsageError(f"Too many arguments: {' '.join(values)}")
+    num_required = code.co_argcount - len(func.__defaults__ or ())
+    for i, name in enumerate(positional):
+        if name in options and i < len(values):
+            raise _UsageError(f"Argument {name} given twice")
+        if name not in options and i >= len(values) and i < num_required:
+            raise _UsageError(f"Missing argument {name}")
+    return values + named_values, options
+
+
+def _usage() -> str:
+    lines = ["Usage: lazylfs COMMAND [ARGS]...", "", "Commands:"]
+    for name, func in _COMMANDS.items():
+        summary = (func.__doc__ or "").strip().splitlines()[0]
+        lines.append(f"  {name:<8}{summary}")
+    return "\n".join(lines)
+
+
+def _fire(args: Sequence[str]) -> None:
+    try:
+        import fire  # type: ignore
+    except ImportError:
+        # Without fire only a summary of the commands can be shown
+        wants_help = bool(set(args) & {"-h", "--help"})
+        text = _usage() + "\n\nInstall lazylfs[cli] for help on each command."
+        print(text, file=sys.stdout if wants_help else sys.stderr)
+        sys.exit(0 if wants_help else 2)
+    fire.Fire(_COMMANDS, command=list(args))
+
+
+def main(args: Optional[Sequence[str]] = None) -> None:
+    """Run the command line interface
+
+    Commands are parsed without fire, which is slow to import, unless help is
+    requested or the command is not recognized; then fire, if installed, takes over
+    to show help or errors like it always has.
+    """
     logging.basicConfig(level=getattr(logging, os.environ.get("LEVEL", "WARNING")))
-    fire.Fire({func.__name__: func for func in [link, track, check]})
+    args = sys.argv[1:] if args is None else list(args)
+
+    func = _COMMANDS.get(args[0]) if args else None
+    if func is None or {"-h", "--help"} & set(args):
+        _fire(args)
+        return
+
+    try:
+        values, options = _parse_args(func, args[1:])
+        # Some arguments can only be validated while running
+        func(*values, **options)
+    except _UsageError as e:
+        print(f"lazylfs {args[0]}: {e}", file=sys.stderr)
+        sys.exit(2)
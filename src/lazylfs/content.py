@@ -1,109 +1,1168 @@
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import hashlib
 import logging
 import os
 import pathlib
+import stat
+import threading
+import time
 from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
     Dict,
+    Generator,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
     Set,
+    Tuple,
+    TypeVar,
+    Union,
 )
 
+from lazylfs import gitutils, metrics, readers, statcache, walk
+
+if TYPE_CHECKING:
+    # Imported lazily since most runs use neither
+    from lazylfs import indexdb, progress
+
 _logger = logging.getLogger(__name__)
 
 _INDEX_NAME = ".shasum"
+_CACHE_NAME = "lazylfs/cache"
+_DATABASE_NAME = "lazylfs/index.sqlite"
+_JOURNAL_NAME = "lazylfs/journals"
+
+_T = TypeVar("_T")
+_U = TypeVar("_U")
+
+
+# Files modified this recently may be modified again without their stat identity
+# changing, on filesystems with coarse timestamps.
+_RACY_NS = 2 * 10**9
+
+_DEFAULT_ALGORITHM = "sha256"
+# Bounds the memory used by a long running service since the fingerprints of
+# targets that have been modified, or removed, are otherwise never forgotten.
+_SERVICE_MEMO_SIZE = 2**18
+_QUICK_BLOCK_SIZE = 64 * 1024
+
+ALGORITHMS: Dict[str, Callable[[], Any]] = {
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "blake2s": hashlib.blake2s,
+}
 
 
 class NotOkError(Exception):
     pass
 
 
-def _sha256(path: pathlib.Path) -> str:
-    h = hashlib.sha256()
-    b = bytearray(128 * 1024)
-    mv = memoryview(b)
-    with path.resolve().open("rb", buffering=0) as f:
-        for n in iter(lambda: f.readinto(mv), 0):  # type: ignore
-            h.update(mv[:n])
+class _IndexEntry(NamedTuple):
+    fingerprint: str
+    quick: Optional[str] = None
+
+
+def _open(path: pathlib.Path) -> BinaryIO:
+    with metrics.timer("resolve"):
+        target = path.resolve()
+    return target.open("rb", buffering=0)  # type: ignore
+
+
+def _hexdigest(
+    path: pathlib.Path,
+    algorithm: str = _DEFAULT_ALGORITHM,
+    reader: str = "auto",
+    block_size: Optional[int] = None,
+    page_cache: str = "keep",
+) -> str:
+    h = ALGORITHMS[algorithm]()
+    num_bytes = 0
+    with metrics.timer("hash"), _open(path) as f:
+        for block in readers.read(f, reader, block_size, page_cache):
+            h.update(block)
+            num_bytes += len(block)
+    metrics.add("files_hashed")
+    metrics.add("bytes_hashed", num_bytes)
     return h.hexdigest()
 
 
-def _fingerprint_from_content(path):
-    return _sha256(path)
+def _quick_fingerprint(path: pathlib.Path) -> str:
+    """Return a fingerprint of the size and a few blocks of the content of `path`
 
+    This detects truncation, appending and swapped files while reading only a small,
+    fixed amount of data from every file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with _open(path) as f:
+        size = os.fstat(f.fileno()).st_size
+        offsets = {
+            0,
+            max(0, (size - _QUICK_BLOCK_SIZE) // 2),
+            max(0, size - _QUICK_BLOCK_SIZE),
+        }
+        for offset in sorted(offsets):
+            h.update(os.pread(f.fileno(), _QUICK_BLOCK_SIZE, offset))
+    return f"quick:{size}:{h.hexdigest()}"
 
-def _fingerprint_from_location(path):
-    index = _read_index(path.parent / _INDEX_NAME)
-    return index.get(path.name)
 
+def _format_fingerprint(algorithm: str, hexdigest: str) -> str:
+    # The default algorithm is left implicit for compatibility with indexes written
+    # before other algorithms were supported, and with sha256sum.
+    if algorithm == _DEFAULT_ALGORITHM:
+        return hexdigest
+    return f"{algorithm}:{hexdigest}"
 
-def _should_be_indexed(path: pathlib.Path) -> bool:
-    return path.is_symlink() and path.is_file() and os.path.isabs(os.readlink(path))
 
+def _algorithm_of(fingerprint: str) -> str:
+    """Return the name of the algorithm used to compute `fingerprint`
 
-def _read_index(path: pathlib.Path) -> Dict[str, str]:
-    if not path.exists():
-        return {}
-    split_lines = [line.split() for line in path.read_text().splitlines()]
-    result = {line[-1]: line[0] for line in split_lines}
+    >>> _algorithm_of("4f9b...")
+    'sha256'
+    >>> _algorithm_of("blake2b:4f9b...")
+    'blake2b'
+    """
+    algorithm, sep, _ = fingerprint.partition(":")
+    if not sep:
+        return _DEFAULT_ALGORITHM
+    return algorithm
+
+
+def _stat_key(path: pathlib.Path) -> Optional[statcache.StatKey]:
+    try:
+        return statcache.stat_key(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+
+class _IndexManager:
+    """Parsed indexes, each read from disk at most once until they are expired
+
+    Indexes are shared between threads and must not be modified other than through
+    :py:meth:`update`.
+
+    :param get_database: Return the database, if any, that mirrors the index at the
+        given path
+    """
+
+    def __init__(
+        self,
+        get_database: Callable[[pathlib.Path], Optional[indexdb.Database]] = (
+            lambda path: None
+        ),
+    ) -> None:
+        # Futures so that threads needing the same index wait for the first to read it
+        self._indexes: Dict[pathlib.Path, concurrent.futures.Future] = {}
+        self._keys: Dict[pathlib.Path, Optional[statcache.StatKey]] = {}
+        self._expired: Set[pathlib.Path] = set()
+        self._lock = threading.Lock()
+        self._get_database = get_database
+
+    def _load(
+        self, path: pathlib.Path, key: Optional[statcache.StatKey]
+    ) -> Dict[str, _IndexEntry]:
+        db = self._get_database(path)
+        if db is None:
+            return _read_index(path)
+
+        if key is None:
+            db.forget_index(path)
+            return {}
+
+        rows = db.get_index(path, key)
+        if rows is not None:
+            metrics.add("indexes_from_database")
+            return {name: _IndexEntry(*row) for name, row in rows.items()}
+
+        index = _read_index(path)
+        db.put_index(path, key, index)
+        return index
+
+    def get(self, path: pathlib.Path) -> Dict[str, _IndexEntry]:
+        """Return the index at `path`, loading it if it has not been already
+
+        Expired indexes are reloaded only if their stat identity has changed.
+        """
+        future = self._indexes.get(path)
+        if future is not None and path not in self._expired:
+            return future.result()
+
+        # Stat before reading so that a concurrent change is detected next time
+        key = _stat_key(path)
+        with self._lock:
+            if path in self._expired:
+                self._expired.discard(path)
+                if self._keys.get(path) != key:
+                    del self._indexes[path]
+                    del self._keys[path]
+
+            future = self._indexes.get(path)
+            is_first = future is None
+            if future is None:
+                future = self._indexes[path] = concurrent.futures.Future()
+                self._keys[path] = key
+
+        if is_first:
+            try:
+                future.set_result(self._load(path, key))
+            except BaseException as e:
+                future.set_exception(e)
+                # Or the error would be raised again without trying to read the index
+                with self._lock:
+                    del self._indexes[path]
+                    del self._keys[path]
+        return future.result()
+
+    def expire(self) -> None:
+        """Revalidate every loaded index the next time that it is requested"""
+        with self._lock:
+            self._expired.update(self._indexes)
+
+    def update(self, path: pathlib.Path, entries: Dict[str, _IndexEntry]) -> None:
+        """Add `entries` to the index at `path`, rewriting it atomically"""
+        index = self.get(path)
+        _write_index(path, {**index, **entries})
+        index.update(entries)
+        key = statcache.stat_key(os.stat(path))
+        with self._lock:
+            self._keys[path] = key
+
+        db = self._get_database(path)
+        if db is not None:
+            db.put_index(path, key, index)
+
+
+class _Session:
+    """State shared by all paths processed in one run
+
+    :param cache: Record fingerprints in the cache of the repository
+    :param trust_cache: Use fingerprints from the cache instead of hashing files whose
+        stat identity has not changed since the fingerprint was recorded
+    :param reader: Strategy for reading files, see :py:func:`readers.read`
+    :param block_size: Size of reads, see :py:func:`readers.read`
+    :param algorithm: Name of the hash algorithm, in :py:data:`ALGORITHMS`, to use
+        for new fingerprints
+    :param quick: Record quick fingerprints when tracking and, when checking,
+        compare only the quick fingerprint of entries that have one
+    :param database: Mirror indexes in a database under the git directory of the
+        repository, and read them from there while they are unchanged
+    :param resume: Use fingerprints from the journal left behind by an earlier run
+        that did not finish instead of hashing files whose stat identity has not
+        changed since. Runs that use the cache keep a journal of the fingerprints
+        they compute, until they finish.
+    :param journal: Keep a journal, if the cache is used
+    :param page_cache: How reading files should affect the page cache, see
+        :py:func:`readers.read`
+    :param memo_size: Remember fingerprints of at most this many targets, forgetting
+        the least recently used first, or of all targets if ``None``
+    """
+
+    def __init__(
+        self,
+        cache: bool = True,
+        trust_cache: bool = False,
+        reader: str = "auto",
+        block_size: Optional[int] = None,
+        algorithm: str = _DEFAULT_ALGORITHM,
+        quick: bool = False,
+        database: bool = False,
+        resume: bool = False,
+        journal: bool = True,
+        page_cache: str = "keep",
+        memo_size: Optional[int] = None,
+    ) -> None:
+        if reader != "auto" and reader not in readers.STRATEGIES:
+            raise ValueError(f"Unknown reader {reader!r}")
+        if page_cache not in readers.PAGE_CACHE_POLICIES:
+            raise ValueError(f"Unknown page cache policy {page_cache!r}")
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {algorithm!r}")
+        self.use_cache = cache
+        self.trust_cache = cache and trust_cache
+        self.reader = reader
+        self.block_size = block_size
+        self.page_cache = page_cache
+        self.algorithm = algorithm
+        self.quick = quick
+        self.use_database = database
+        self.resume = resume
+        self.use_journal = cache and journal
+        self.indexes = _IndexManager(self.database)
+        self.progress: Optional[progress.Progress] = None
+        self.num_bytes_avoided = 0
+        self.num_files_hashed = 0
+        # Nanoseconds since the epoch, see :py:data:`_RACY_NS`
+        self.started_ns = time.time_ns()
+        self._caches: Dict[pathlib.Path, statcache.StatCache] = {}
+        self._databases: Dict[pathlib.Path, indexdb.Database] = {}
+        self._journals: Dict[pathlib.Path, statcache.Journal] = {}
+        self._memo: collections.OrderedDict[Hashable, concurrent.futures.Future] = (
+            collections.OrderedDict()
+        )
+        self._memo_size = memo_size
+        # Keys added since racy fingerprints were last forgotten
+        self._new_keys: Set[Hashable] = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> _Session:
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if self.progress is not None:
+            self.progress.close()
+        try:
+            for cache in self._caches.values():
+                cache.save()
+            for journal in self._journals.values():
+                journal.close(finished=exc_type is None)
+        finally:
+            for db in self._databases.values():
+                db.close()
+        _logger.info(
+            "Hashed %d distinct files, avoided reading %d bytes",
+            self.num_files_hashed,
+            self.num_bytes_avoided,
+        )
+
+    def memoize(self, key: Hashable, num_bytes: int, func: Callable[[], str]) -> str:
+        """Return the fingerprint for `key`, calling `func` only the first time
+
+        Concurrent calls with the same key wait for the first call to finish.
+        """
+        with self._lock:
+            future = self._memo.get(key)
+            if future is not None:
+                self._memo.move_to_end(key)
+                self.num_bytes_avoided += num_bytes
+                metrics.add("memo_hits")
+                metrics.add("bytes_avoided", num_bytes)
+                is_first = False
+            else:
+                future = self._memo[key] = concurrent.futures.Future()
+                self._new_keys.add(key)
+                self.num_files_hashed += 1
+                is_first = True
+                if self._memo_size is not None and len(self._memo) > self._memo_size:
+                    # Callers waiting for an evicted future still hold it
+                    evicted, _ = self._memo.popitem(last=False)
+                    self._new_keys.discard(evicted)
+
+        if is_first:
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def forget_racy(self, racy_after: int) -> None:
+        """Forget fingerprints that may not be reused by later calls to `memoize`
+
+        Those are the ones that could not be computed and those of files modified,
+        according to their stat identity, at or after `racy_after` nanoseconds since
+        the epoch since such files may change again without their stat identity
+        changing, on filesystems with coarse timestamps.
+        Only fingerprints memoized since the last call are considered; earlier ones
+        were kept by a call with an earlier `racy_after`, so they remain usable.
+        """
+        with self._lock:
+            for key in self._new_keys:
+                future = self._memo.get(key)
+                if future is None:
+                    continue
+                # Keys are the stat identity of a target and an algorithm
+                mtime_ns = key[0][3]  # type: ignore
+                if mtime_ns >= racy_after or (
+                    future.done() and future.exception() is not None
+                ):
+                    del self._memo[key]
+            self._new_keys.clear()
+
+    def cache(self, path: pathlib.Path) -> Optional[statcache.StatCache]:
+        """Return the cache for the repository that `path` belongs to, if any"""
+        if not self.use_cache:
+            return None
+
+        git_dir = gitutils.find_git_dir(pathlib.Path(os.path.abspath(path.parent)))
+        if git_dir is None:
+            return None
+
+        with self._lock:
+            if git_dir not in self._caches:
+                self._caches[git_dir] = statcache.StatCache.load(git_dir / _CACHE_NAME)
+            return self._caches[git_dir]
+
+    def journal(self, path: pathlib.Path) -> Optional[statcache.Journal]:
+        """Return the journal for the repository that `path` belongs to, if any"""
+        if not (self.use_journal or self.resume):
+            return None
+
+        git_dir = gitutils.find_git_dir(pathlib.Path(os.path.abspath(path.parent)))
+        if git_dir is None:
+            return None
+
+        with self._lock:
+            if git_dir not in self._journals:
+                journal = statcache.Journal(
+                    git_dir / _JOURNAL_NAME, self.resume, self.use_journal
+                )
+                if self.resume:
+                    _logger.info("Resuming with %d journal entries", len(journal))
+                self._journals[git_dir] = journal
+            return self._journals[git_dir]
+
+    def database(self, path: pathlib.Path) -> Optional[indexdb.Database]:
+        """Return the database for the repository that `path` belongs to, if any"""
+        if not self.use_database:
+            return None
+
+        git_dir = gitutils.find_git_dir(pathlib.Path(os.path.abspath(path.parent)))
+        if git_dir is None:
+            return None
+
+        from lazylfs import indexdb
+
+        with self._lock:
+            if git_dir not in self._databases:
+                self._databases[git_dir] = indexdb.Database(git_dir / _DATABASE_NAME)
+            return self._databases[git_dir]
+
+
+def _fingerprint_from_target(
+    path: pathlib.Path, key: statcache.StatKey, algorithm: str, session: _Session
+) -> str:
+    def _usable(fingerprint: Optional[str]) -> Optional[str]:
+        if fingerprint is None or _algorithm_of(fingerprint) != algorithm:
+            return None
+        return fingerprint
+
+    cache = session.cache(path)
+    journal = session.journal(path)
+    racy = key[3] >= session.started_ns - _RACY_NS
+    fingerprint = None if journal is None else _usable(journal.get(key))
+    if fingerprint is not None:
+        metrics.add("journal_hits")
+    elif cache is not None and session.trust_cache:
+        fingerprint = _usable(cache.get(key))
+        if fingerprint is not None:
+            metrics.add("cache_hits")
+
+    if fingerprint is None:
+        fingerprint = _format_fingerprint(
+            algorithm,
+            _hexdigest(
+                path,
+                algorithm,
+                session.reader,
+                session.block_size,
+                session.page_cache,
+            ),
+        )
+        # Files modified shortly before the run started may have been modified
+        # again since without their stat identity changing, so are not cached.
+        if cache is not None and not racy:
+            cache.put(key, fingerprint)
+    if journal is not None and not racy:
+        journal.put(key, fingerprint)
+
+    if session.progress is not None:
+        session.progress.add(num_bytes=key[2])
+    return fingerprint
+
+
+def _fingerprint_from_content(
+    path: pathlib.Path, session: _Session, algorithm: Optional[str] = None
+) -> str:
+    """Return the fingerprint of the content of the target of `path`
+
+    :param algorithm: Algorithm to use, defaults to that of the session
+    """
+    algorithm = algorithm or session.algorithm
+    with metrics.timer("fingerprint"):
+        # Keyed on the target so that it is read at most once no matter how many
+        # links point to it.
+        key = statcache.stat_key(os.stat(path))
+        return session.memoize(
+            (key, algorithm),
+            key[2],
+            functools.partial(_fingerprint_from_target, path, key, algorithm, session),
+        )
+
+
+def _index_entry(entry: walk.Entry, session: _Session) -> Optional[_IndexEntry]:
+    index = session.indexes.get(entry.parent / _INDEX_NAME)
+    return index.get(entry.name)
+
+
+def _fingerprint_from_location(entry: walk.Entry, session: _Session) -> Optional[str]:
+    index_entry = _index_entry(entry, session)
+    return None if index_entry is None else index_entry.fingerprint
+
+
+def _should_be_indexed(entry: walk.Entry) -> bool:
+    return (
+        entry.is_symlink()
+        and entry.path.is_file()
+        and os.path.isabs(os.readlink(entry.path))
+    )
+
+
+def _parse_index_line(line: List[str]) -> _IndexEntry:
+    # Optional fields go between the fingerprint and the name so that the first and
+    # last fields mean the same thing as in indexes written by earlier versions.
+    quick = next((field for field in line[1:-1] if field.startswith("quick:")), None)
+    return _IndexEntry(line[0], quick)
+
+
+def _parse_index(text: str) -> Dict[str, _IndexEntry]:
+    split_lines = [line.split() for line in text.splitlines()]
+    result = {line[-1]: _parse_index_line(line) for line in split_lines}
     if len(result) != len(split_lines):
         raise RuntimeError("Index contains duplicate entries")
     return result
 
 
-def _append_to_index(link_path: pathlib.Path) -> None:
-    index_path = link_path.parent / _INDEX_NAME
-    index = _read_index(index_path)
+def _read_index(path: pathlib.Path) -> Dict[str, _IndexEntry]:
+    if not path.exists():
+        return {}
+    with metrics.timer("read_index"):
+        index = _parse_index(path.read_text())
+    metrics.add("indexes_read")
+    metrics.add("index_lines_read", len(index))
+    return index
+
+
+def affected_paths(path: pathlib.Path, rev: str) -> List[pathlib.Path]:
+    """Return the paths to check to verify a change to `path` since `rev`
+
+    For indexes these are the links whose entries were added, modified or removed,
+    so that the whole directory need not be checked, and for other paths it is the
+    path itself.
+    """
+    if path.name != _INDEX_NAME:
+        return [path]
+
+    before = gitutils.show(path.parent, rev, path.name)
+    old = {} if before is None else _parse_index(os.fsdecode(before))
+    new = _read_index(path)
+    names = set(old) | set(new)
+    return [
+        path.parent / name for name in sorted(names) if old.get(name) != new.get(name)
+    ]
+
+
+def _write_index(path: pathlib.Path, index: Dict[str, _IndexEntry]) -> None:
+    # Sorted to keep diffs small and written to a temporary file first so that the
+    # index is never left half-written.
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with metrics.timer("write_index"), tmp_path.open("w") as f:
+            for name in sorted(index):
+                fields = [field for field in index[name] if field is not None]
+                f.write(f"{' '.join(fields)}  {name}\n")
+            # Or the index would lose its permissions when replaced
+            try:
+                os.fchmod(f.fileno(), stat.S_IMODE(os.stat(path).st_mode))
+            except FileNotFoundError:
+                pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            tmp_path.unlink()
+        raise
+
+
+def _imap(
+    func: Callable[[_T], _U],
+    items: Iterable[_T],
+    jobs: int,
+    executor_factory: Callable[
+        [int], concurrent.futures.Executor
+    ] = concurrent.futures.ThreadPoolExecutor,
+) -> Generator[_U, None, None]:
+    """Like :py:func:`map` but with up to `jobs` items being processed concurrently
+
+    Results are yielded in the same order as the items they were computed from and
+    only a bounded number of items are consumed ahead of the results.
+    Exceptions are raised when the result that caused them would have been yielded.
+    """
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+
+    with executor_factory(jobs) as executor:
+        pending: Deque[concurrent.futures.Future] = collections.deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _aimap(
+    func: Callable[[_T], _U],
+    items: Iterable[_T],
+    concurrency: int,
+    key: Callable[[_T], str],
+) -> Generator[_U, None, None]:
+    """Like :py:func:`_imap` but scheduling items on an :py:mod:`asyncio` event loop
+
+    Items are grouped by `key`, typically the mount that they will read from, and at
+    most `concurrency` items from each group are processed at a time, so that a slow
+    mount does not starve the others.
+    The event loop runs only while the caller waits for the next result.
+    """
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    executors: Dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+    semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def _run(item: _T) -> _U:
+        k = key(item)
+        if k not in semaphores:
+            semaphores[k] = asyncio.Semaphore(concurrency)
+            executors[k] = concurrent.futures.ThreadPoolExecutor(concurrency)
+        async with semaphores[k]:
+            return await loop.run_in_executor(executors[k], func, item)
+
+    pending: Deque[asyncio.Task] = collections.deque()
+    try:
+        for item in items:
+            pending.append(loop.create_task(_run(item)))
+            if len(pending) >= 4 * concurrency:
+                yield loop.run_until_complete(pending.popleft())
+        while pending:
+            yield loop.run_until_complete(pending.popleft())
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        for executor in executors.values():
+            executor.shutdown()
+        loop.close()
+
+
+def _mount_of(entry: walk.Entry) -> str:
+    # Links are tracked only if their target is absolute so for all other entries the
+    # mount does not matter much.
+    try:
+        target = os.readlink(entry.path)
+    except OSError:
+        return ""
+    return readers.mount_point(os.path.join(os.fspath(entry.parent), target))
+
+
+def _map(
+    func: Callable[[walk.Entry], _U],
+    entries: Iterable[walk.Entry],
+    jobs: int,
+    concurrency: Optional[int],
+) -> Generator[_U, None, None]:
+    if concurrency:
+        return _aimap(func, entries, concurrency, _mount_of)
+    return _imap(func, entries, jobs)
+
+
+def _is_in_index(
+    link_path: pathlib.Path, index_entry: _IndexEntry, session: _Session
+) -> bool:
+    index = session.indexes.get(link_path.parent / _INDEX_NAME)
 
     if link_path.name in index:
-        if index[link_path.name] == _fingerprint_from_content(link_path):
-            return
-        else:
+        existing = index[link_path.name]
+        if existing.fingerprint != index_entry.fingerprint:
             raise TypeError("Cannot reassign existing key")
+        # Quick fingerprints may be added to existing entries
+        return index_entry.quick is None or existing.quick == index_entry.quick
+
+    return False
+
+
+def _track_one(
+    entry: walk.Entry, session: _Session
+) -> Tuple[pathlib.Path, Optional[_IndexEntry]]:
+    if not _should_be_indexed(entry):
+        return entry.path, None
+
+    # Existing entries are compared using the algorithm they were computed with
+    expected = _fingerprint_from_location(entry, session)
+    algorithm = None if expected is None else _algorithm_of(expected)
+    fingerprint = _fingerprint_from_content(entry.path, session, algorithm)
+    quick = _quick_fingerprint(entry.path) if session.quick else None
+    return entry.path, _IndexEntry(fingerprint, quick)
+
+
+def _start_progress(
+    entries: Iterable[walk.Entry], session: _Session
+) -> List[walk.Entry]:
+    """Start reporting progress on `entries`, returning them as a list
+
+    The total size is that of the distinct targets of the links among `entries`
+    since each target is read at most once.
+    """
+    from lazylfs import progress
+
+    entries = list(entries)
+    sizes = {}
+    for entry in entries:
+        if not entry.is_symlink():
+            continue
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            continue
+        sizes[st.st_dev, st.st_ino] = st.st_size
+    session.progress = progress.Progress(len(entries), sum(sizes.values()))
+    return entries
+
+
+def track(
+    paths: Iterable[Union[pathlib.Path, walk.Entry]],
+    jobs: int = 1,
+    cache: bool = True,
+    trust_cache: bool = False,
+    reader: str = "auto",
+    block_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    algorithm: str = _DEFAULT_ALGORITHM,
+    quick: bool = False,
+    show_progress: bool = False,
+    database: bool = False,
+    resume: bool = False,
+    page_cache: str = "keep",
+) -> None:
+    """Add the links among `paths` to the index of their respective directory
+
+    Indexes are written only after all paths have been fingerprinted, so if any link
+    conflicts with its index then no index is modified.
+
+    :param paths: Paths to track, paths that are not links to files are ignored
+    :param jobs: Number of files to hash concurrently
+    :param cache: See :py:class:`_Session`
+    :param trust_cache: See :py:class:`_Session`
+    :param reader: See :py:class:`_Session`
+    :param block_size: See :py:class:`_Session`
+    :param concurrency: Hash files using an asyncio event loop with up to this many
+        files per mount being read concurrently, instead of using `jobs` threads
+    :param algorithm: See :py:class:`_Session`
+    :param quick: Also record quick fingerprints, including for links that are
+        already tracked, see :py:class:`_Session`
+    :param show_progress: Report progress on stderr, this requires holding all
+        `paths` in memory to estimate the time remaining.
+    :param database: See :py:class:`_Session`
+    :param resume: See :py:class:`_Session`
+    :param page_cache: See :py:class:`_Session`
+    """
+    with _Session(
+        cache,
+        trust_cache,
+        reader,
+        block_size,
+        algorithm,
+        quick,
+        database,
+        resume,
+        page_cache=page_cache,
+    ) as session:
+        entries: Iterable[walk.Entry] = map(walk.as_entry, paths)
+        if show_progress:
+            entries = _start_progress(entries, session)
+        _track_entries(entries, session, jobs, concurrency)
 
-    with index_path.open("a") as f:
-        f.write(f"{_fingerprint_from_content(link_path)}  {link_path.name}\n")
 
+def untrack(paths: Iterable[pathlib.Path]) -> None:
+    """Remove the entries of `paths` from the index of their respective directory
 
-def track(paths: Set[pathlib.Path]) -> None:
+    Indexes that are left empty are removed.
+    """
+    removals: Dict[pathlib.Path, Set[str]] = collections.defaultdict(set)
     for path in paths:
-        if _should_be_indexed(path):
-            _append_to_index(path)
+        removals[path.parent / _INDEX_NAME].add(path.name)
 
+    for index_path, names in sorted(removals.items()):
+        index = _read_index(index_path)
+        if not names & index.keys():
+            continue
+        remaining = {name: entry for name, entry in index.items() if name not in names}
+        if remaining:
+            _write_index(index_path, remaining)
+        else:
+            index_path.unlink()
+
+
+def _track_entries(
+    entries: Iterable[walk.Entry],
+    session: _Session,
+    jobs: int = 1,
+    concurrency: Optional[int] = None,
+) -> None:
+    additions: Dict[pathlib.Path, Dict[str, _IndexEntry]] = collections.defaultdict(
+        dict
+    )
+    track_one = functools.partial(_track_one, session=session)
+    for path, index_entry in _map(track_one, entries, jobs, concurrency):
+        if session.progress is not None:
+            session.progress.add(num_files=1)
+        if index_entry is None or _is_in_index(path, index_entry, session):
+            continue
+        additions[path.parent / _INDEX_NAME][path.name] = index_entry
+
+    for index_path, index_entries in sorted(additions.items()):
+        session.indexes.update(index_path, index_entries)
+
+
+def _matches(path: pathlib.Path, index_entry: _IndexEntry, session: _Session) -> bool:
+    if session.quick and index_entry.quick is not None:
+        # Only sampled blocks that match are trusted. A mismatch is confirmed by
+        # hashing in full, in case the quick fingerprint itself is what is wrong.
+        if _quick_fingerprint(path) == index_entry.quick:
+            return True
+        metrics.add("quick_mismatches")
+
+    key_from_content = _fingerprint_from_content(
+        path, session, _algorithm_of(index_entry.fingerprint)
+    )
+    return key_from_content == index_entry.fingerprint
+
+
+# Reasons for a path not being OK
+MISSING = "missing"
+EXTRA = "extra"
+MISMATCH = "mismatch"
+UNREADABLE = "unreadable"
 
-def _check_index(path):
-    index = _read_index(path)
+# A path and the reason that it is not OK, if it is not
+_Result = Tuple[pathlib.Path, Optional[str]]
+
+
+def _check_index(path: pathlib.Path, session: _Session) -> Optional[str]:
+    index = session.indexes.get(path)
 
     indexed_names = set(index)
     existing_names = set(
-        path.name for path in path.parent.iterdir() if _should_be_indexed(path)
+        entry.name for entry in walk.scandir(path.parent) if _should_be_indexed(entry)
     )
 
-    if indexed_names != existing_names:
-        return False
+    if indexed_names - existing_names:
+        return MISSING
+    if existing_names - indexed_names:
+        return EXTRA
 
-    for name, key_from_location in index.items():
-        if _fingerprint_from_content(path.parent / name) != key_from_location:
-            return False
+    for name, index_entry in index.items():
+        if not _matches(path.parent / name, index_entry, session):
+            return MISMATCH
 
-    return True
+    return None
 
 
-def check(paths: Set[pathlib.Path]) -> None:
-    ok = True
-    for path in paths:
-        if path.name == _INDEX_NAME:
-            if _check_index(path):
-                continue
-        elif _should_be_indexed(path):
-            if _fingerprint_from_location(path) == _fingerprint_from_content(path):
-                continue
-        else:
-            if _fingerprint_from_location(path) is None:
-                continue
+def _check_path(entry: walk.Entry, session: _Session) -> Optional[str]:
+    if entry.name == _INDEX_NAME:
+        return _check_index(entry.path, session)
+    elif _should_be_indexed(entry):
+        index_entry = _index_entry(entry, session)
+        if index_entry is None:
+            return EXTRA
+        if not _matches(entry.path, index_entry, session):
+            return MISMATCH
+        return None
+    elif _fingerprint_from_location(entry, session) is not None:
+        return MISSING
+    else:
+        return None
+
+
+def _check_one(entry: walk.Entry, session: _Session) -> _Result:
+    try:
+        return entry.path, _check_path(entry, session)
+    except OSError as e:
+        _logger.debug("Could not check %s: %s", entry.path, e)
+        return entry.path, UNREADABLE
 
-        ok &= False
-        _logger.debug("NOK %s", path)
+
+_SHARD_SIZE = 256
+
+# Session of a worker process, see _check_in_processes
+_worker_session: Optional[_Session] = None
+
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    global _worker_session
+    _worker_session = _Session(**options)
+
+
+def _check_shard(paths: List[str]) -> List[_Result]:
+    assert _worker_session is not None
+    return [
+        _check_one(walk.Entry.from_path(pathlib.Path(path)), _worker_session)
+        for path in paths
+    ]
+
+
+def _shard(entries: Iterable[walk.Entry]) -> Iterator[List[str]]:
+    """Group consecutive entries, preferably splitting only between directories"""
+    shard: List[str] = []
+    parent = None
+    for entry in entries:
+        is_full = len(shard) >= _SHARD_SIZE and entry.parent != parent
+        if is_full or len(shard) >= 16 * _SHARD_SIZE:
+            yield shard
+            shard = []
+        shard.append(os.fspath(entry.path))
+        parent = entry.parent
+    if shard:
+        yield shard
+
+
+def _adopting_journals(
+    entries: Iterable[walk.Entry], session: _Session
+) -> Iterator[walk.Entry]:
+    """Yield `entries` after opening the journal of their repository in `session`
+
+    Workers only read journals so the session of the main process must adopt those
+    left behind by earlier runs for them to be removed once the run finishes.
+    """
+    for entry in entries:
+        session.journal(entry.path)
+        yield entry
+
+
+def _check_in_processes(
+    entries: Iterable[walk.Entry], processes: int, options: Dict[str, Any]
+) -> Generator[_Result, None, None]:
+    """Check entries in worker processes, each with its own session
+
+    Since the walker yields the children of a directory together, sharding
+    consecutive entries means that most indexes are parsed by only one worker.
+    Fingerprints computed by workers are not recorded in the persistent cache, so
+    workers load the cache only if it is to be trusted.
+    """
+    executor_factory = functools.partial(
+        concurrent.futures.ProcessPoolExecutor,
+        initializer=_init_worker,
+        initargs=({**options, "cache": options["trust_cache"]},),
+    )
+    for results in _imap(_check_shard, _shard(entries), processes, executor_factory):
+        yield from results
+
+
+def check(
+    paths: Iterable[Union[pathlib.Path, walk.Entry]],
+    jobs: int = 1,
+    cache: bool = True,
+    trust_cache: bool = False,
+    reader: str = "auto",
+    block_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    processes: Optional[int] = None,
+    quick: bool = False,
+    show_progress: bool = False,
+    database: bool = False,
+    resume: bool = False,
+    fail_fast: bool = False,
+    on_result: Optional[Callable[[pathlib.Path, Optional[str]], None]] = None,
+    page_cache: str = "keep",
+) -> None:
+    """Check `paths` against the index of their respective directory
+
+    :param paths: Paths to check
+    :param jobs: Number of files to hash concurrently
+    :param cache: See :py:class:`_Session`
+    :param trust_cache: See :py:class:`_Session`
+    :param reader: See :py:class:`_Session`
+    :param block_size: See :py:class:`_Session`
+    :param concurrency: Hash files using an asyncio event loop with up to this many
+        files per mount being read concurrently, instead of using `jobs` threads
+    :param processes: Check paths in this many worker processes, instead of using
+        `jobs` threads, to use more than one core when paths are many and small
+    :param quick: Compare only the size and a few blocks of files that have a quick
+        fingerprint, see :py:class:`_Session`
+    :param show_progress: Report progress on stderr, this requires holding all
+        `paths` in memory to estimate the time remaining.
+    :param database: See :py:class:`_Session`, worker processes do not use it
+    :param resume: See :py:class:`_Session`, worker processes do not add to the
+        journal
+    :param fail_fast: Stop at the first path that is not OK, cancelling work that
+        has not started yet
+    :param on_result: Called with every path, as soon as it has been checked, and
+        ``None`` if it is OK or otherwise the reason that it is not; one of
+        :py:data:`MISSING`, :py:data:`EXTRA`, :py:data:`MISMATCH` or
+        :py:data:`UNREADABLE`.
+    :param page_cache: See :py:class:`_Session`
+    :raises NotOkError: if any path differs from the index
+    """
+    with _Session(
+        cache,
+        trust_cache,
+        reader,
+        block_size,
+        quick=quick,
+        database=database,
+        resume=resume,
+        page_cache=page_cache,
+    ) as session:
+        entries: Iterable[walk.Entry] = map(walk.as_entry, paths)
+        if show_progress:
+            entries = _start_progress(entries, session)
+        results: Generator[_Result, None, None]
+        if processes is not None and processes > 1:
+            options = dict(
+                cache=cache,
+                trust_cache=trust_cache,
+                reader=reader,
+                block_size=block_size,
+                quick=quick,
+                resume=resume,
+                journal=False,
+                page_cache=page_cache,
+            )
+            if resume:
+                entries = _adopting_journals(entries, session)
+            results = _check_in_processes(entries, processes, options)
+        else:
+            check_one = functools.partial(_check_one, session=session)
+            results = _map(check_one, entries, jobs, concurrency)
+        ok = _collect_results(results, session, fail_fast, on_result)
 
     if not ok:
         raise NotOkError
+
+
+def _collect_results(
+    results: Generator[_Result, None, None],
+    session: _Session,
+    fail_fast: bool = False,
+    on_result: Optional[Callable[[pathlib.Path, Optional[str]], None]] = None,
+) -> bool:
+    """Report `results` and return whether all of them are OK"""
+    ok = True
+    try:
+        for path, reason in results:
+            if session.progress is not None:
+                session.progress.add(num_files=1)
+            if on_result is not None:
+                on_result(path, reason)
+            if reason is None:
+                continue
+
+            ok &= False
+            _logger.debug("NOK %s (%s)", path, reason)
+            if fail_fast:
+                break
+    finally:
+        # Cancels work that has not started yet
+        results.close()
+    return ok
+
+
+class Service:
+    """Track and check batches of paths, reusing what is learned between batches
+
+    Fingerprints of targets are reused while their stat identity is unchanged, like
+    when trusting the cache, except for targets modified shortly before a batch
+    started. Indexes are reloaded when their stat identity has changed.
+    Fingerprints are saved in the cache, if used, when the service is closed.
+
+    :param jobs: Number of files to hash concurrently
+    :param concurrency: See :py:func:`check`
+    :param options: Options for the session, see :py:class:`_Session`; fingerprints
+        of at most :py:data:`_SERVICE_MEMO_SIZE` targets are remembered by default
+    """
+
+    def __init__(
+        self, jobs: int = 1, concurrency: Optional[int] = None, **options: Any
+    ) -> None:
+        self._jobs = jobs
+        self._concurrency = concurrency
+        options.setdefault("memo_size", _SERVICE_MEMO_SIZE)
+        self._session = _Session(**options)
+
+    def __enter__(self) -> Service:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._session.__exit__(*exc_info)
+
+    def close(self) -> None:
+        self._session.__exit__(None, None, None)
+
+    @contextlib.contextmanager
+    def _batch(self) -> Iterator[_Session]:
+        start = self._session.started_ns = time.time_ns()
+        self._session.indexes.expire()
+        try:
+            yield self._session
+        finally:
+            self._session.forget_racy(start - _RACY_NS)
+
+    def track(self, paths: Iterable[Union[pathlib.Path, walk.Entry]]) -> None:
+        """Like :py:func:`track` but using the options of the service"""
+        with self._batch() as session:
+            entries = map(walk.as_entry, paths)
+            _track_entries(entries, session, self._jobs, self._concurrency)
+
+    def check(self, paths: Iterable[Union[pathlib.Path, walk.Entry]]) -> List[_Result]:
+        """Check `paths` and return every path with the reason it is not OK, if any
+
+        :return: Pairs like those passed to `on_result` by :py:func:`check`
+        """
+        results: List[_Result] = []
+        with self._batch() as session:
+            check_one = functools.partial(_check_one, session=session)
+            entries = map(walk.as_entry, paths)
+            _collect_results(
+                _map(check_one, entries, self._jobs, self._concurrency),
+                session,
+                on_result=lambda path, reason: results.append((path, reason)),
+            )
+        return results
+
+
+def query(
+    top: pathlib.Path, under: pathlib.Path, sync: bool = False
+) -> Iterator[Tuple[pathlib.Path, str]]:
+    """Yield the tracked links in `top` pointing under `under` and their targets
+
+    Answers come from the database of the repository after indexes that have
+    changed, or been removed, since they were last put there have been reloaded.
+    Indexes are put in the database by runs that use it, or when `sync` is given.
+
+    :param top: An absolute path to a directory in a repository
+    :param under: An absolute path
+    :param sync: Find all indexes in `top` instead of only revalidating those that
+        are already in the database
+    """
+    with _Session(cache=False, database=True) as session:
+        db = session.database(top / _INDEX_NAME)
+        if db is None:
+            raise ValueError(f"Not in a repository: {top}")
+
+        if sync:
+            index_paths = [
+                entry.path for entry in walk.walk(top) if entry.name == _INDEX_NAME
+            ]
+        else:
+            index_paths = db.index_paths()
+        for index_path in index_paths:
+            if top in index_path.parents:
+                session.indexes.get(index_path)
+
+        for link, target in db.links(os.path.normpath(under)):
+            if top in link.parents:
+                yield link, target
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import functools
+import os
+import pathlib
+from typing import List, Optional
+
+
+@functools.lru_cache(maxsize=4096)
+def find_git_dir(path: pathlib.Path) -> Optional[pathlib.Path]:
+    """Find the git directory of the repository that the directory `path` belongs to
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     pathlib.Path(tmp, ".git").mkdir()
+    ...     pathlib.Path(tmp, "a", "e").mkdir(parents=True)
+    ...     find_git_dir(pathlib.Path(tmp, "a", "e")) == pathlib.Path(tmp, ".git")
+    True
+
+    :param path: An absolute path to a directory
+    :return: Path to the git directory or ``None`` if `path` is not in a repository
+    """
+    candidate = path / ".git"
+    if candidate.is_dir():
+        return candidate
+
+    if candidate.is_file():
+        # Worktrees and submodules use a file pointing to the actual git directory
+        text = candidate.read_text()
+        if text.startswith("gitdir:"):
+            return (path / text[len("gitdir:") :].strip()).resolve()
+
+    if path.parent == path:
+        return None
+
+    return find_git_dir(path.parent)
+
+
+def _git(directory: pathlib.Path, *args: str) -> bytes:
+    # Imported lazily since most runs never use git and the import is a noticeable
+    # part of the startup time
+    import subprocess
+
+    try:
+        return subprocess.run(
+            ["git", *args],
+            cwd=directory,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ).stdout
+    except subprocess.CalledProcessError as e:
+        raise ValueError(os.fsdecode(e.stderr).strip()) from None
+
+
+def _split(output: bytes) -> List[str]:
+    return [os.fsdecode(name) for name in output.split(b"\0") if name]
+
+
+def changed_paths(directory: pathlib.Path, rev: str) -> List[pathlib.Path]:
+    """Return the paths under `directory` that differ between `rev` and the worktree
+
+    Paths that are untracked, and not ignored, are included since they too differ
+    from `rev`.
+    Paths that have been deleted are included, since they are usually of interest
+    too, so not all of the returned paths exist.
+
+    :param directory: An absolute path to a directory in a repository
+    :param rev: Any revision understood by git
+    :raises ValueError: with the error reported by git if git fails, for instance
+        because `rev` does not exist
+    """
+    diffed = _git(
+        directory, "diff", "--name-only", "--no-renames", "--relative", "-z", rev
+    )
+    untracked = _git(directory, "ls-files", "--others", "--exclude-standard", "-z")
+    names = dict.fromkeys(_split(diffed) + _split(untracked))
+    return [directory / name for name in names]
+
+
+def show(directory: pathlib.Path, rev: str, name: str) -> Optional[bytes]:
+    """Return the content of the file `name` in `directory` as of `rev`
+
+    :return: The content or ``None`` if the file did not exist in `rev`
+    """
+    import subprocess
+
+    try:
+        return subprocess.run(
+            ["git", "show", f"{rev}:./{name}"],
+            cwd=directory,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout
+    except subprocess.CalledProcessError:
+        return None
@@ -0,0 +1,164 @@
+"""A consolidated copy of the indexes of a repository for fast lookups and queries
+
+The ``.shasum`` files remain the source of truth; the copy of every index is
+tagged with the stat identity of the file it was read from and is ignored once the
+file changes.
+"""
+
+from __future__ import annotations
+
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from lazylfs import statcache
+
+# Fingerprint and quick fingerprint
+Row = Tuple[str, Optional[str]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexes (
+    path TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    index_path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    quick TEXT,
+    target TEXT,
+    PRIMARY KEY (index_path, name)
+);
+CREATE INDEX IF NOT EXISTS entries_by_target ON entries (target);
+"""
+
+
+def _normalize(path: pathlib.Path) -> str:
+    # Indexes are stored by absolute path so that they are found regardless of the
+    # working directory of the run that put them there
+    return os.path.abspath(path)
+
+
+def _target(link: str) -> Optional[str]:
+    try:
+        return os.path.normpath(os.path.join(os.path.dirname(link), os.readlink(link)))
+    except OSError:
+        return None
+
+
+class Database:
+    """Indexes stored in an SQLite database at `path`
+
+    Changes are committed when the database is closed.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     db = Database(pathlib.Path(tmp, "index.sqlite"))
+    ...     index_path = pathlib.Path(tmp, ".shasum")
+    ...     db.put_index(index_path, (0, 1, 2, 3, 4), {"a": ("f00", None)})
+    ...     print(db.get_index(index_path, (0, 1, 2, 3, 4)))
+    ...     print(db.get_index(index_path, (0, 1, 2, 3, 5)))
+    ...     db.close()
+    {'a': ('f00', None)}
+    None
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Connections are shared by the threads of a session, hence the lock
+        self._connection = sqlite3.connect(
+            os.fspath(path), timeout=60, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def get_index(
+        self, path: pathlib.Path, key: statcache.StatKey
+    ) -> Optional[Dict[str, Row]]:
+        """Return the entries of the index at `path` if it had the stat identity `key`
+
+        :return: The entries or ``None`` if the index is not in the database or has
+            changed since it was put there.
+        """
+        normalized = _normalize(path)
+        with self._lock:
+            stored = self._connection.execute(
+                "SELECT dev, ino, size, mtime_ns, ctime_ns FROM indexes WHERE path = ?",
+                (normalized,),
+            ).fetchone()
+            if stored is None or tuple(stored) != tuple(key):
+                return None
+            rows = self._connection.execute(
+                "SELECT name, fingerprint, quick FROM entries WHERE index_path = ?",
+                (normalized,),
+            ).fetchall()
+        return {name: (fingerprint, quick) for name, fingerprint, quick in rows}
+
+    def put_index(
+        self, path: pathlib.Path, key: statcache.StatKey, entries: Mapping[str, Row]
+    ) -> None:
+        """Replace the index at `path` with `entries` read from a file with stat `key`
+
+        The target of every link is recorded too so that it can be queried.
+        """
+        normalized = _normalize(path)
+        directory = os.path.dirname(normalized)
+        rows = [
+            (normalized, name, fingerprint, quick, _target(f"{directory}/{name}"))
+            for name, (fingerprint, quick) in entries.items()
+        ]
+        with self._lock:
+            self._forget_index(normalized)
+            self._connection.execute(
+                "INSERT INTO indexes VALUES (?, ?, ?, ?, ?, ?)", (normalized, *key)
+            )
+            self._connection.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def _forget_index(self, normalized: str) -> None:
+        self._connection.execute(
+            "DELETE FROM entries WHERE index_path = ?", (normalized,)
+        )
+        self._connection.execute("DELETE FROM indexes WHERE path = ?", (normalized,))
+
+    def forget_index(self, path: pathlib.Path) -> None:
+        """Remove the index at `path`, if any, from the database"""
+        with self._lock:
+            self._forget_index(_normalize(path))
+
+    def index_paths(self) -> List[pathlib.Path]:
+        """Return the path of every index in the database"""
+        with self._lock:
+            rows = self._connection.execute("SELECT path FROM indexes").fetchall()
+        return [pathlib.Path(path) for path, in rows]
+
+    def links(self, under: str = "/") -> Iterator[Tuple[pathlib.Path, str]]:
+        """Yield every indexed link, and its target, that points to a path under `under`
+
+        :param under: Absolute, normalized path of a directory
+        """
+        prefix = os.path.join(under, "")
+        # Every path starting with the prefix sorts between these bounds, which lets
+        # the query use the index on targets.
+        bounds = (prefix, prefix[:-1] + chr(ord("/") + 1))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT index_path, name, target FROM entries"
+                " WHERE target >= ? AND target < ? ORDER BY index_path, name",
+                bounds,
+            ).fetchall()
+        for index_path, name, target in rows:
+            yield pathlib.Path(index_path).parent / name, target
@@ -1,36 +1,301 @@
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
+import os
 import pathlib
-from typing import Iterable
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-from lazylfs import pathutils
+from lazylfs import gitutils, metrics, pathutils, walk
 
 _logger = logging.getLogger(__name__)
 
 
-def _find(top: pathlib.Path, includes: Iterable[str]) -> Iterable[pathlib.Path]:
-    for include in includes:
-        yield from top.glob(include)
+class _Selection:
+    """Which relative paths to include and which directories to descend into"""
 
+    def __init__(self, includes: Iterable[str], excludes: Iterable[str]) -> None:
+        self._included = walk.Patterns(includes)
+        self._excluded = walk.Patterns(excludes)
 
-def link(src: pathlib.Path, dst: pathlib.Path, includes: Iterable[str]) -> None:
+    def prunes(self, path: str) -> bool:
+        max_depth = self._included.max_depth
+        if max_depth is not None and path.count("/") + 1 >= max_depth:
+            return True
+        return self._excluded.match(path)
+
+    def selects(self, path: str) -> bool:
+        return self._included.match(path) and not self._excluded.match(path)
+
+
+def _find(
+    top: pathlib.Path, includes: Iterable[str], excludes: Iterable[str] = ()
+) -> Iterator[str]:
+    """Yield the relative path of every regular file matching the patterns
+
+    The tree is traversed once no matter how many patterns are given and directories
+    that are excluded, or too deep to be included, are not descended into.
+    """
+    selection = _Selection(includes, excludes)
+    prefix_len = len(os.path.join(os.fspath(top), ""))
+
+    def _relative(entry: walk.Entry) -> str:
+        return os.path.join(os.fspath(entry.parent), entry.name)[prefix_len:]
+
+    def _prune(entry: walk.Entry) -> bool:
+        return selection.prunes(_relative(entry))
+
+    for entry in walk.walk(top, prune=_prune):
+        if not entry.is_file():
+            continue
+        path = _relative(entry)
+        if selection.selects(path):
+            yield path
+
+
+# Identity of a directory, the modification time and number of links, that changes
+# when entries are added to or removed from it.
+_DirKey = Tuple[int, int]
+
+# Directories modified this recently may be modified again without their mtime
+# changing, on filesystems with coarse timestamps, so they are always rescanned.
+_RACY_NS = 2 * 10**9
+_RACY_KEY: _DirKey = (-1, -1)
+
+_STATE_DIR = "lazylfs/link"
+
+
+def _state_path(
+    src: pathlib.Path, dst: pathlib.Path, includes: List[str], excludes: List[str]
+) -> pathlib.Path:
+    git_dir = gitutils.find_git_dir(dst)
+    if git_dir is None:
+        raise ValueError("Expected dst to be in a repository")
+    # The state is valid only for the same arguments
+    arguments = json.dumps([os.fspath(src), os.fspath(dst), includes, excludes])
+    return git_dir / _STATE_DIR / hashlib.sha256(arguments.encode()).hexdigest()
+
+
+def _read_state(path: pathlib.Path) -> Dict[str, _DirKey]:
+    try:
+        lines = path.read_text().splitlines()
+    except FileNotFoundError:
+        return {}
+    state = {}
+    for line in lines:
+        mtime_ns, nlink, directory = line.split(" ", 2)
+        state[directory] = (int(mtime_ns), int(nlink))
+    return state
+
+
+def _write_state(path: pathlib.Path, state: Dict[str, _DirKey]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as f:
+        for directory, (mtime_ns, nlink) in sorted(state.items()):
+            f.write(f"{mtime_ns} {nlink} {directory}\n")
+    os.replace(tmp_path, path)
+
+
+def _find_changed(
+    top: pathlib.Path, selection: _Selection, previous: Dict[str, _DirKey]
+) -> Tuple[List[str], Dict[str, _DirKey], List[str]]:
+    """Find matching files in directories that changed since `previous` was recorded
+
+    Unchanged directories are stat'ed but not listed; their subdirectories are
+    taken from `previous` instead.
+
+    :return: Relative paths of the files found, the state to use next time and the
+        relative paths of the directories that were listed.
+    """
+    subdirs: Dict[str, List[str]] = collections.defaultdict(list)
+    for directory in previous:
+        if directory:
+            subdirs[os.path.dirname(directory)].append(directory)
+
+    found: List[str] = []
+    state: Dict[str, _DirKey] = {}
+    listed: List[str] = []
+    racy_after = time.time_ns() - _RACY_NS
+
+    pending = [""]
+    while pending:
+        directory = pending.pop()
+        try:
+            st = os.stat(os.path.join(top, directory))
+        except OSError:
+            continue
+
+        key = (st.st_mtime_ns, st.st_nlink)
+        if previous.get(directory) == key:
+            state[directory] = key
+            pending.extend(subdirs[directory])
+            continue
+
+        state[directory] = _RACY_KEY if st.st_mtime_ns > racy_after else key
+        listed.append(directory)
+        try:
+            entries = walk.scandir(top / directory)
+        except OSError:
+            continue
+        for entry in entries:
+            if walk.is_pruned(entry.name):
+                continue
+            path = os.path.join(directory, entry.name)
+            if entry.is_dir():
+                if not selection.prunes(path):
+                    pending.append(path)
+            elif entry.is_file() and selection.selects(path):
+                found.append(path)
+
+    return found, state, listed
+
+
+def _orphans(src: pathlib.Path, directory: pathlib.Path, recursive: bool) -> List[str]:
+    """Return the links in `directory` that point into `src` but to nothing"""
+    entries: Iterable[walk.Entry]
+    if recursive:
+        entries = walk.walk(directory)
+    else:
+        try:
+            entries = walk.scandir(directory)
+        except OSError:
+            return []
+
+    prefix = os.path.join(os.fspath(src), "")
+    result = []
+    for entry in entries:
+        if not entry.is_symlink():
+            continue
+        path = os.fspath(entry.path)
+        target = os.readlink(path)
+        if target.startswith(prefix) and not os.path.lexists(target):
+            result.append(path)
+    return result
+
+
+def _link_directory(src: str, dst: str, names: List[str]) -> Tuple[int, int]:
+    """Link every one of `names` in the directory `dst` to the same name in `src`
+
+    :return: Number of links created and skipped respectively
+    """
+    # Created once per directory rather than once per file
+    os.makedirs(dst, exist_ok=True)
+
+    num_created = num_skipped = 0
+    for name in names:
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        _logger.debug("Linking %s", dst_path)
+        # Most links do not exist yet so try creating them before looking
+        try:
+            os.symlink(src_path, dst_path)
+            num_created += 1
+        except FileExistsError:
+            pathutils.ensure_lnk(pathlib.Path(dst_path), pathlib.Path(src_path))
+            _logger.debug("Path exists and is equivalent, skipping")
+            num_skipped += 1
+
+    metrics.add("links_created", num_created)
+    metrics.add("links_skipped", num_skipped)
+    return num_created, num_skipped
+
+
+def link(
+    src: pathlib.Path,
+    dst: pathlib.Path,
+    includes: Iterable[str],
+    excludes: Iterable[str] = (),
+    jobs: int = 1,
+    incremental: bool = False,
+    prune: bool = False,
+) -> None:
+    """Create a link in `dst` to every file in `src` matching the patterns
+
+    :param jobs: Number of directories to create links in concurrently
+    :param incremental: Look for files only in directories that have changed since
+        the last incremental run with the same arguments, and look for links in
+        `dst` whose target in `src` has been removed.
+    :param prune: Remove the links whose target has been removed, and their index
+        entries, instead of only warning about them
+    :raises FileExistsError: if a path exists and is different from the link that
+        would be created there
+    """
     if not src.is_dir():
         raise ValueError("Expected src to be a directory")
+    # Used more than once
+    includes = list(includes)
+    excludes = list(excludes)
+
+    if incremental:
+        state_path = _state_path(src, dst, includes, excludes)
+        previous = _read_state(state_path)
+        with metrics.timer("find"):
+            paths, state, listed = _find_changed(
+                src, _Selection(includes, excludes), previous
+            )
+        metrics.add("directories_listed", len(listed))
+        # Links to removed files can only be in directories that changed, or in
+        # directories that no longer exist.
+        orphans = [
+            path
+            for directory in listed
+            for path in _orphans(src, dst / directory, recursive=False)
+        ] + [
+            path
+            for directory in previous.keys() - state.keys()
+            for path in _orphans(src, dst / directory, recursive=True)
+        ]
+    else:
+        paths = list(
+            metrics.timed("find", _find(src, includes, excludes), "paths_found")
+        )
+        orphans = []
 
-    src_tails = {
-        pathlib.Path(path).relative_to(src)
-        for path in _find(src, includes)
-        if path.is_file() and not path.is_symlink()
-    }
+    by_directory: Dict[str, List[str]] = collections.defaultdict(list)
+    for path in paths:
+        directory, name = os.path.split(path)
+        by_directory[directory].append(name)
 
     dst.mkdir(exist_ok=True)
 
-    for tail in sorted(src_tails):
-        src_path = src / tail
-        dst_path = dst / tail
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
-        _logger.debug("Linking %s", str(tail))
+    def _link_one(item: Tuple[str, List[str]]) -> Tuple[int, int]:
+        directory, names = item
+        return _link_directory(
+            os.path.join(src, directory), os.path.join(dst, directory), sorted(names)
+        )
 
-        if not pathutils.ensure_lnk(dst_path, src_path):
-            _logger.debug("Path exists and is equivalent, skipping")
+    items = sorted(by_directory.items())
+    with metrics.timer("link"):
+        if jobs > 1:
+            with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                counts = list(executor.map(_link_one, items))
+        else:
+            counts = [_link_one(item) for item in items]
+
+    _logger.info(
+        "Created %d links, skipped %d existing links",
+        sum(num_created for num_created, _ in counts),
+        sum(num_skipped for _, num_skipped in counts),
+    )
+
+    for path in sorted(orphans):
+        if prune:
+            _logger.info("Removing %s since its target is gone", path)
+            os.unlink(path)
+        else:
+            _logger.warning("Target of %s is gone", path)
+    if prune and orphans:
+        # Imported here since most links do not prune anything
+        from lazylfs import content
+
+        # Or checking would report the removed links as missing
+        content.untrack(map(pathlib.Path, orphans))
+
+    if incremental:
+        # Only once all links have been created, or a failed run would be forgotten
+        _write_state(state_path, state)
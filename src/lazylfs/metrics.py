@@ -0,0 +1,139 @@
+"""Counters and timers describing where a run spends its time
+
+Everything is a no-op until :py:func:`enable` is called so that instrumented code
+pays no more than a function call and a global lookup when metrics are not wanted.
+
+Timers are summed over all threads, and may be nested, so their sum may exceed the
+wall time of the run. Work done in worker processes is not included.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_enabled = False
+_lock = threading.Lock()
+_counts: Dict[str, int] = {}
+_seconds: Dict[str, float] = {}
+
+
+def enable() -> None:
+    """Start collecting metrics, discarding any collected previously"""
+    global _enabled
+    with _lock:
+        _counts.clear()
+        _seconds.clear()
+        _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def add(name: str, value: int = 1) -> None:
+    """Add `value` to the counter `name`"""
+    if not _enabled:
+        return
+    with _lock:
+        _counts[name] = _counts.get(name, 0) + value
+
+
+class _Timer:
+    __slots__ = ("_name", "_start")
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self._start
+        with _lock:
+            _seconds[self._name] = _seconds.get(self._name, 0.0) + elapsed
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str):
+    """Return a context manager that adds the time spent in it to the timer `name`
+
+    >>> enable()
+    >>> with timer("nap"):
+    ...     time.sleep(0.01)
+    >>> summary()["seconds"]["nap"] >= 0.01
+    True
+    >>> disable()
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def _timed(name: str, iterator: Iterator[T], count: str) -> Iterator[T]:
+    timer_ = _Timer(name)
+    while True:
+        with timer_:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        add(count)
+        yield item
+
+
+def timed(name: str, iterable: Iterable[T], count: str) -> Iterable[T]:
+    """Time the producing of the items of `iterable` as `name` and count them as `count`
+
+    Useful for lazy iterables, such as walkers, whose work is interleaved with the
+    work of their consumer.
+    """
+    if not _enabled:
+        return iterable
+    return _timed(name, iter(iterable), count)
+
+
+def summary() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {"counts": dict(_counts), "seconds": dict(_seconds)}
+
+
+def render(collected: Dict[str, Dict[str, Any]], style: str = "text") -> str:
+    """Render metrics as returned by :py:func:`summary`
+
+    >>> print(render({"counts": {"files": 3}, "seconds": {"hash": 1.5}}))
+    files  3
+    hash   1.500s
+
+    :param style: Either ``text``, for people, or ``json``, for programs
+    """
+    if style == "json":
+        import json
+
+        return json.dumps(collected, sort_keys=True)
+    if style != "text":
+        raise ValueError(f"Unknown style {style!r}")
+
+    counts = sorted(collected["counts"].items())
+    seconds = sorted(collected["seconds"].items())
+    rows = [(name, str(value)) for name, value in counts]
+    rows += [(name, f"{value:.3f}s") for name, value in seconds]
+    width = max((len(name) for name, _ in rows), default=0) + 2
+    return "\n".join(f"{name:<{width}}{value}" for name, value in rows)
@@ -0,0 +1,112 @@
+"""Live reporting of how far a long running command has come"""
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from typing import Optional, TextIO
+
+_INTERVAL = 0.5
+# Weight of the latest interval in the smoothed throughput
+_SMOOTHING = 0.3
+
+
+def _format_bytes(num_bytes: float) -> str:
+    """
+    >>> _format_bytes(1234567)
+    '1.2 MB'
+    """
+    for unit in ("B", "kB", "MB", "GB"):
+        if num_bytes < 1000:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1000
+    return f"{num_bytes:.1f} TB"
+
+
+def _format_duration(seconds: float) -> str:
+    """
+    >>> _format_duration(3725)
+    '1:02:05'
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+class Progress:
+    """Count completed files and bytes and show them on one, rewritten, line
+
+    Updates are cheap; the line is rendered at most once per interval, by whichever
+    thread happens to update the counts when the interval has elapsed.
+
+    :param total_files: Number of files that will be completed
+    :param total_bytes: Number of bytes that will be completed, the estimated time
+        remaining is based on this unless it is zero.
+    :param stream: Where to write the line, it should be a terminal
+    """
+
+    def __init__(
+        self, total_files: int, total_bytes: int, stream: Optional[TextIO] = None
+    ) -> None:
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.num_files = 0
+        self.num_bytes = 0
+        self._stream = sys.stderr if stream is None else stream
+        self._lock = threading.Lock()
+        self._start = self._last = time.monotonic()
+        self._last_num_bytes = 0
+        self._rate: Optional[float] = None
+
+    def __enter__(self) -> Progress:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Render the final counts and move to a new line"""
+        with self._lock:
+            self._render(time.monotonic())
+        self._stream.write("\n")
+        self._stream.flush()
+
+    def add(self, num_files: int = 0, num_bytes: int = 0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.num_files += num_files
+            self.num_bytes += num_bytes
+            if now - self._last >= _INTERVAL:
+                self._render(now)
+
+    def _remaining_seconds(self, now: float) -> Optional[float]:
+        if self.total_bytes and self._rate:
+            return (self.total_bytes - self.num_bytes) / self._rate
+        if self.num_files:
+            elapsed = now - self._start
+            return elapsed * (self.total_files - self.num_files) / self.num_files
+        return None
+
+    def _render(self, now: float) -> None:
+        elapsed = now - self._last
+        if elapsed > 0:
+            rate = (self.num_bytes - self._last_num_bytes) / elapsed
+            if self._rate is None:
+                self._rate = rate
+            else:
+                self._rate += _SMOOTHING * (rate - self._rate)
+        self._last = now
+        self._last_num_bytes = self.num_bytes
+
+        parts = [
+            f"{self.num_files}/{self.total_files} files",
+            f"{_format_bytes(self.num_bytes)}/{_format_bytes(self.total_bytes)}",
+            f"{_format_bytes(self._rate or 0)}/s",
+        ]
+        remaining = self._remaining_seconds(now)
+        if remaining is not None:
+            parts.append(f"ETA {_format_duration(max(0.0, remaining))}")
+        # Clear to the end of the line in case the previous line was longer
+        self._stream.write("\r" + ", ".join(parts) + "\x1b[K")
+        self._stream.flush()
@@ -0,0 +1,257 @@
+"""Strategies for reading the content of files that are to be hashed
+
+Every strategy yields the content of a file as a sequence of buffers that are only
+valid until the next buffer is requested.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import functools
+import logging
+import mmap
+import os
+import re
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+_logger = logging.getLogger(__name__)
+
+_KiB = 1024
+_MiB = 1024 * _KiB
+
+DEFAULT_BLOCK_SIZE = 128 * _KiB
+
+# Files on these are read in few, large requests since every request is slow
+_NETWORK_FS_TYPES = {
+    "9p",
+    "afs",
+    "ceph",
+    "cifs",
+    "fuse.sshfs",
+    "glusterfs",
+    "lustre",
+    "ncpfs",
+    "nfs",
+    "nfs4",
+    "smb3",
+    "smbfs",
+}
+_NETWORK_BLOCK_SIZE = 4 * _MiB
+
+# Files at least this large are read in larger blocks
+_LARGE_FILE_SIZE = 64 * _MiB
+_LARGE_BLOCK_SIZE = 1 * _MiB
+
+
+def _readinto(f: BinaryIO, size: int, block_size: int) -> Iterator[memoryview]:
+    mv = memoryview(bytearray(block_size))
+    for n in iter(lambda: f.readinto(mv), 0):  # type: ignore
+        yield mv[:n]
+
+
+def _mmap(f: BinaryIO, size: int, block_size: int) -> Iterator[memoryview]:
+    # If the file is truncated while it is mapped, reading past its new end raises
+    # SIGBUS, which kills the process, so this is never chosen automatically.
+    if not size:
+        return
+
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mm, "madvise"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        for offset in range(0, len(mm), block_size):
+            with memoryview(mm) as mv:
+                yield mv[offset : offset + block_size]
+    finally:
+        try:
+            mm.close()
+        except BufferError:
+            # The consumer still holds on to the last block, the mapping will be
+            # closed when it is garbage collected.
+            pass
+
+
+STRATEGIES: Dict[str, Callable[[BinaryIO, int, int], Iterator[memoryview]]] = {
+    "readinto": _readinto,
+    "mmap": _mmap,
+}
+
+# How reading a file should affect the page cache:
+# keep: like any other read
+# sequential: hint that the file is read sequentially so that read-ahead is larger
+# drop: like sequential and evict every block from the page cache once it has been
+#   consumed, so that hashing does not push out the data of other programs
+# direct: bypass the page cache using O_DIRECT, where supported, otherwise drop
+PAGE_CACHE_POLICIES = ("keep", "sequential", "drop", "direct")
+
+# Offsets, sizes and addresses of O_DIRECT reads must be multiples of this
+_DIRECT_ALIGNMENT = 4 * _KiB
+_DROP_OVERLAP = 4 * _MiB
+
+
+def _advise(fd: int, offset: int, length: int, advice: str) -> None:
+    # Advice is only a hint so platforms and filesystems without it are fine
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+    except OSError:
+        pass
+
+
+def _dropping(blocks: Iterator[memoryview], fd: int) -> Iterator[memoryview]:
+    _advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+    offset = 0
+    for block in blocks:
+        yield block
+        # Pages are cached in folios, of up to a few MiB, which are only dropped
+        # once all of their pages are in an advised range.
+        start = max(0, offset - _DROP_OVERLAP)
+        offset += len(block)
+        _advise(fd, start, offset - start, "POSIX_FADV_DONTNEED")
+    _advise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+
+
+def _set_direct(fd: int, enabled: bool) -> None:
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    if enabled:
+        flags |= os.O_DIRECT
+    else:
+        flags &= ~os.O_DIRECT
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+
+
+def _readinto_direct(f: BinaryIO, size: int, block_size: int) -> Iterator[memoryview]:
+    fd = f.fileno()
+    block_size = -(-block_size // _DIRECT_ALIGNMENT) * _DIRECT_ALIGNMENT
+    # Anonymous mappings are page aligned, unlike bytearrays
+    mv = memoryview(mmap.mmap(-1, block_size))
+    try:
+        _set_direct(fd, True)
+        n = f.readinto(mv)  # type: ignore
+    except (AttributeError, OSError) as e:
+        # Not supported by the platform or filesystem, e.g. tmpfs
+        _logger.debug("Not reading %d directly: %s", fd, e)
+        if hasattr(os, "O_DIRECT"):
+            _set_direct(fd, False)
+        yield from _dropping(_readinto(f, size, block_size), fd)
+        return
+
+    while n:
+        yield mv[:n]
+        n = f.readinto(mv)  # type: ignore
+
+
+def _unescape(field: str) -> str:
+    # Whitespace and backslashes in mount points are octal escaped
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+@functools.lru_cache(maxsize=None)
+def _mounts() -> List[Tuple[str, int, str]]:
+    """Return the mount point, device id and filesystem type of every mount"""
+    try:
+        with open("/proc/self/mountinfo") as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+
+    result = []
+    for line in lines:
+        fields = line.split()
+        major, minor = fields[2].split(":")
+        result.append(
+            (
+                _unescape(fields[4]),
+                os.makedev(int(major), int(minor)),
+                fields[fields.index("-") + 1],
+            )
+        )
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def _filesystem_types() -> Dict[int, str]:
+    return {st_dev: fs_type for _, st_dev, fs_type in _mounts()}
+
+
+def filesystem_type(st_dev: int) -> Optional[str]:
+    """Return the type of the filesystem with device id `st_dev`, if known"""
+    return _filesystem_types().get(st_dev)
+
+
+def mount_point(path: str) -> str:
+    """Return the mount point under which the absolute `path` is, as far as known
+
+    Unlike :py:func:`os.stat` this does not touch the filesystem so it is fast even
+    for paths on slow network mounts.
+    """
+    best = "/"
+    for candidate, _, _ in _mounts():
+        if len(candidate) > len(best) and (
+            path == candidate or path.startswith(candidate.rstrip("/") + "/")
+        ):
+            best = candidate
+    return best
+
+
+def choose(st: os.stat_result) -> Tuple[str, int]:
+    """Return a suitable strategy and block size for a file with stat result `st`
+
+    Files are never mapped since a file, typically on remote storage, that is
+    truncated while being hashed would then kill the process instead of being
+    reported as unreadable.
+    """
+    if filesystem_type(st.st_dev) in _NETWORK_FS_TYPES:
+        return "readinto", _NETWORK_BLOCK_SIZE
+    if st.st_size >= _LARGE_FILE_SIZE:
+        return "readinto", _LARGE_BLOCK_SIZE
+    return "readinto", DEFAULT_BLOCK_SIZE
+
+
+def read(
+    f: BinaryIO,
+    strategy: str = "auto",
+    block_size: Optional[int] = None,
+    page_cache: str = "keep",
+) -> Iterator[memoryview]:
+    """Yield the content of the file `f`
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryFile() as f:
+    ...     _ = f.write(b"Alpha Bravo")
+    ...     _ = f.seek(0)
+    ...     [bytes(block) for block in read(f, "readinto", 6)]
+    [b'Alpha ', b'Bravo']
+
+    :param f: File opened in binary mode
+    :param strategy: Name of a strategy in :py:data:`STRATEGIES` or ``"auto"`` to
+        choose one, and a block size, based on the size of the file and the type of
+        its filesystem, see :py:func:`choose`.
+    :param block_size: Size of the buffers, the default depends on the strategy
+    :param page_cache: Name of a policy in :py:data:`PAGE_CACHE_POLICIES`, policies
+        other than ``keep`` and ``sequential`` are implemented only for the
+        ``readinto`` strategy which ``auto`` then always chooses.
+    """
+    if page_cache not in PAGE_CACHE_POLICIES:
+        raise ValueError(f"Unknown page cache policy {page_cache!r}")
+
+    st = os.fstat(f.fileno())
+    if strategy == "auto":
+        strategy, default_block_size = choose(st)
+        if page_cache in ("drop", "direct"):
+            strategy = "readinto"
+    else:
+        default_block_size = DEFAULT_BLOCK_SIZE
+    block_size = block_size or default_block_size
+
+    if page_cache in ("drop", "direct") and strategy != "readinto":
+        raise ValueError(f"Cannot {page_cache} pages when reading using {strategy}")
+    if page_cache == "direct":
+        return _readinto_direct(f, st.st_size, block_size)
+    blocks = STRATEGIES[strategy](f, st.st_size, block_size)
+    if page_cache == "drop":
+        return _dropping(blocks, f.fileno())
+    if page_cache == "sequential":
+        _advise(f.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+    return blocks
@@ -0,0 +1,212 @@
+"""Answer requests to track and check paths from a single, long running, process
+
+Two framings are supported.
+The default is modelled on the long running filter process protocol of git, see
+gitattributes(5), and uses pkt-lines; every line is prefixed by its length,
+including the prefix, as four hexadecimal digits and a group of lines is ended by a
+flush packet, ``0000``.
+The client starts with a handshake::
+
+    packet:          lazylfs-client
+    packet:          version=1
+    packet:          0000
+    packet:          lazylfs-server
+    packet:          version=1
+    packet:          0000
+    packet:          capability=check
+    packet:          capability=track
+    packet:          0000
+    packet:          capability=check
+    packet:          capability=track
+    packet:          0000
+
+and may then send any number of requests, each answered before the next is read::
+
+    packet:          command=check
+    packet:          pathname=a/g
+    packet:          pathname=a/h
+    packet:          0000
+    packet:          status=nok
+    packet:          mismatch=a/g
+    packet:          0000
+
+The status is ``ok``, ``nok``, if any path is not OK, or ``error``, if the request
+could not be carried out, in which case an ``error=`` line describes why.
+Every path that is not OK is listed with the reason that it is not.
+
+The other framing is one request per line, like ``check a/g``, answered by one line
+of JSON, like ``{"status": "nok", "results": [{"path": "a/g", "reason":
+"mismatch"}]}``, and does not start with a handshake.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
+
+_logger = logging.getLogger(__name__)
+
+# Paths, and the reason they are not OK, as returned by a handler
+Results = List[Tuple[str, str]]
+Handler = Callable[[str, Sequence[str]], Results]
+
+FRAMINGS = ("pkt-line", "newline")
+COMMANDS = ("check", "track")
+
+_VERSION = "1"
+# The largest packet that git allows
+_MAX_PKT_LEN = 65520
+_FLUSH = b"0000"
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def read_pkt_line(stream: BinaryIO) -> Optional[str]:
+    """Read one packet from `stream`
+
+    >>> import io
+    >>> stream = io.BytesIO(b"000ahello\\n0000")
+    >>> read_pkt_line(stream), read_pkt_line(stream)
+    ('hello', None)
+
+    :return: The text of the packet, without a trailing newline, or ``None`` for a
+        flush packet
+    :raises EOFError: if `stream` ends before the first byte of the packet
+    """
+    header = stream.read(4)
+    if not header:
+        raise EOFError
+    try:
+        length = int(header, 16)
+    except ValueError:
+        raise ProtocolError(f"Invalid packet length {header!r}") from None
+    if length == 0:
+        return None
+    if length <= 4 or length > _MAX_PKT_LEN:
+        raise ProtocolError(f"Invalid packet length {length}")
+
+    payload = stream.read(length - 4)
+    if len(payload) != length - 4:
+        raise ProtocolError("Unexpected end of stream")
+    text = payload.decode()
+    return text[:-1] if text.endswith("\n") else text
+
+
+def write_pkt_line(stream: BinaryIO, text: Optional[str]) -> None:
+    """Write `text`, or a flush packet if it is ``None``, as one packet to `stream`
+
+    >>> import io
+    >>> stream = io.BytesIO()
+    >>> write_pkt_line(stream, "hello"), write_pkt_line(stream, None)
+    (None, None)
+    >>> stream.getvalue()
+    b'000ahello\\n0000'
+    """
+    if text is None:
+        stream.write(_FLUSH)
+        return
+    payload = f"{text}\n".encode()
+    if len(payload) + 4 > _MAX_PKT_LEN:
+        raise ProtocolError(f"Packet too long: {text[:80]}...")
+    stream.write(b"%04x" % (len(payload) + 4) + payload)
+
+
+def _read_group(stream: BinaryIO) -> List[str]:
+    lines = []
+    line = read_pkt_line(stream)
+    while line is not None:
+        lines.append(line)
+        line = read_pkt_line(stream)
+    return lines
+
+
+def _write_group(stream: BinaryIO, lines: Sequence[str]) -> None:
+    for line in lines:
+        write_pkt_line(stream, line)
+    write_pkt_line(stream, None)
+    stream.flush()
+
+
+def _handle(
+    handler: Handler, command: str, paths: Sequence[str]
+) -> Tuple[str, Results, Optional[str]]:
+    """Return the status, the results and the error, if any, of a request"""
+    if command not in COMMANDS:
+        return "error", [], f"Unknown command {command!r}"
+    try:
+        results = handler(command, paths)
+    except Exception as e:
+        _logger.debug("Failed to %s %s", command, paths, exc_info=True)
+        return "error", [], f"{type(e).__name__}: {e}"
+    return ("nok" if results else "ok"), results, None
+
+
+def _handshake(stdin: BinaryIO, stdout: BinaryIO) -> None:
+    if _read_group(stdin) != ["lazylfs-client", f"version={_VERSION}"]:
+        raise ProtocolError("Unsupported client or version")
+    _write_group(stdout, ["lazylfs-server", f"version={_VERSION}"])
+
+    advertised = set(_read_group(stdin))
+    capabilities = [f"capability={command}" for command in COMMANDS]
+    _write_group(stdout, [line for line in capabilities if line in advertised])
+
+
+def _serve_pkt_lines(handler: Handler, stdin: BinaryIO, stdout: BinaryIO) -> None:
+    _handshake(stdin, stdout)
+    while True:
+        try:
+            lines = _read_group(stdin)
+        except EOFError:
+            return
+
+        command = None
+        paths = []
+        for line in lines:
+            key, _, value = line.partition("=")
+            if key == "command":
+                command = value
+            elif key == "pathname":
+                paths.append(value)
+        status, results, error = _handle(handler, str(command), paths)
+
+        response = [f"status={status}"]
+        response.extend(f"{reason}={path}" for path, reason in results)
+        if error is not None:
+            response.append(f"error={error}")
+        _write_group(stdout, response)
+
+
+def _serve_lines(handler: Handler, stdin: BinaryIO, stdout: BinaryIO) -> None:
+    for line in stdin:
+        command, _, path = line.decode().rstrip("\n").partition(" ")
+        status, results, error = _handle(handler, command, [path])
+
+        response: Dict[str, Any] = {
+            "status": status,
+            "results": [{"path": path, "reason": reason} for path, reason in results],
+        }
+        if error is not None:
+            response["error"] = error
+        stdout.write(json.dumps(response).encode() + b"\n")
+        stdout.flush()
+
+
+def serve(
+    handler: Handler, stdin: BinaryIO, stdout: BinaryIO, framing: str = "pkt-line"
+) -> None:
+    """Answer requests read from `stdin` on `stdout` until `stdin` is closed
+
+    :param handler: Called with the command and paths of every request, returns
+        the paths that are not OK and the reason that they are not
+    :param framing: One of :py:data:`FRAMINGS`
+    :raises ProtocolError: if the client does not follow the protocol
+    """
+    if framing == "pkt-line":
+        _serve_pkt_lines(handler, stdin, stdout)
+    elif framing == "newline":
+        _serve_lines(handler, stdin, stdout)
+    else:
+        raise ValueError(f"Unknown framing {framing!r}")
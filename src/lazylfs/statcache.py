@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+from lazylfs import metrics
+
+if TYPE_CHECKING:
+    from typing import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+StatKey = Tuple[int, int, int, int, int]
+
+_DEFAULT_MAX_SIZE = 1024 * 1024
+# How many times more lines than entries the backing file of a cache may hold
+_COMPACT_RATIO = 2
+
+_HEXDIGITS = frozenset("0123456789abcdef")
+
+
+def stat_key(st: os.stat_result) -> StatKey:
+    """Return the parts of `st` that change when the content of a file may change"""
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+
+def _format_line(key: StatKey, fingerprint: str) -> str:
+    return " ".join(map(str, key)) + f" {fingerprint}\n"
+
+
+def _parse_line(line: str) -> Tuple[StatKey, str]:
+    *key, fingerprint = line.split()
+    return tuple(map(int, key)), fingerprint  # type: ignore
+
+
+def _is_fingerprint(text: str) -> bool:
+    """Return whether `text` is a complete fingerprint
+
+    >>> _is_fingerprint("blake2s:" + 64 * "0"), _is_fingerprint(63 * "0")
+    (True, False)
+    """
+    algorithm, _, hexdigest = text.rpartition(":")
+    try:
+        num_digits = 2 * hashlib.new(algorithm or "sha256").digest_size
+    except ValueError:
+        return False
+    return len(hexdigest) == num_digits and all(c in _HEXDIGITS for c in hexdigest)
+
+
+def _read_entries(lines: Iterable[str]) -> Iterator[Tuple[StatKey, str]]:
+    """Yield the entries of complete lines, with their line endings, in `lines`
+
+    >>> lines = ["0 1 0 0 0 " + 64 * "0" + "\\n", "0 2 0 0 0 " + 64 * "0"]
+    >>> [key for key, _ in _read_entries(lines)]
+    [(0, 1, 0, 0, 0)]
+    """
+    for line in lines:
+        if not line.endswith("\n"):
+            # The last line is incomplete if the run was killed while writing it
+            continue
+        try:
+            key, fingerprint = _parse_line(line)
+        except ValueError:
+            continue
+        if len(key) == 5 and _is_fingerprint(fingerprint):
+            yield key, fingerprint
+
+
+@contextlib.contextmanager
+def _open_locked(path: pathlib.Path) -> Iterator[TextIO]:
+    """Open `path` for appending, holding an exclusive lock until it is closed"""
+    while True:
+        f = path.open("a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # The file may have been replaced, when compacted, while waiting
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                break
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+    with f:
+        yield f
+
+
+def _try_lock(f: TextIO) -> bool:
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class StatCache:
+    """Fingerprints of files keyed by their stat identity
+
+    When full, the least recently used entries are evicted first.
+
+    >>> cache = StatCache(max_size=2)
+    >>> cache.put((0, 1, 0, 0, 0), "a")
+    >>> cache.put((0, 2, 0, 0, 0), "b")
+    >>> cache.get((0, 1, 0, 0, 0))
+    'a'
+    >>> cache.put((0, 3, 0, 0, 0), "c")
+    >>> cache.get((0, 2, 0, 0, 0)) is None
+    True
+
+    The backing file, if any, is a log that entries are appended to when saved, so
+    that runs that add few entries to a large cache need not rewrite it. It is read
+    only once an entry is looked up, and compacted, by rewriting the entries that
+    would be kept in memory, once it has grown to more than
+    :py:data:`_COMPACT_RATIO` times the maximum size.
+    """
+
+    def __init__(
+        self, path: Optional[pathlib.Path] = None, max_size: int = _DEFAULT_MAX_SIZE
+    ):
+        self._path = path
+        self._max_size = max_size
+        self._entries: OrderedDict[StatKey, str] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = path is None
+        # Entries put since the cache was loaded or saved, in the order put
+        self._new: Dict[StatKey, str] = {}
+
+    @classmethod
+    def load(cls, path: pathlib.Path, max_size: int = _DEFAULT_MAX_SIZE) -> StatCache:
+        """Create a cache backed by `path`, reading entries saved there when needed"""
+        return cls(path, max_size)
+
+    def _load(self) -> None:
+        # Must be called with the lock held
+        if self._loaded:
+            return
+        assert self._path is not None
+        self._loaded = True
+        try:
+            with self._path.open() as f:
+                entries = collections.OrderedDict(_read_entries(f))
+        except FileNotFoundError:
+            return
+        # Entries saved by other runs are older, in memory, than those put by this
+        # run, since the file is only read once they have been put.
+        for key in list(entries)[: -self._max_size]:
+            del entries[key]
+        for key, fingerprint in self._entries.items():
+            entries.pop(key, None)
+            entries[key] = fingerprint
+        self._entries = entries
+        self._evict()
+        _logger.debug("Loaded %d cache entries from %s", len(entries), self._path)
+
+    def _evict(self) -> None:
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, key: StatKey) -> Optional[str]:
+        with self._lock:
+            self._load()
+            fingerprint = self._entries.get(key)
+            if fingerprint is not None:
+                self._entries.move_to_end(key)
+            return fingerprint
+
+    def put(self, key: StatKey, fingerprint: str) -> None:
+        with self._lock:
+            self._entries[key] = fingerprint
+            self._entries.move_to_end(key)
+            self._evict()
+            self._new.pop(key, None)
+            self._new[key] = fingerprint
+
+    def save(self) -> None:
+        """Append new entries to the backing file, if any, compacting it if needed"""
+        if self._path is None or not self._new:
+            return
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            lines = [_format_line(k, fp) for k, fp in self._new.items()]
+            lines = lines[-self._max_size :]
+            text = "".join(lines)
+            with _open_locked(self._path) as f:
+                # Written at once so that lines appended concurrently, for instance
+                # by other runs on another machine, are not interleaved.
+                f.write(text)
+                f.flush()
+                size = os.fstat(f.fileno()).st_size
+                # Lines are of nearly equal length
+                if size * len(lines) > _COMPACT_RATIO * self._max_size * len(text):
+                    self._compact()
+            self._new.clear()
+        _logger.debug("Saved %d cache entries to %s", len(lines), self._path)
+
+    def _compact(self) -> None:
+        # Must be called with the lock held, and the file locked
+        assert self._path is not None
+        self._loaded = False
+        self._load()
+        tmp_path = self._path.with_name(f".{self._path.name}.{os.getpid()}")
+        with tmp_path.open("w") as f:
+            for key, fingerprint in self._entries.items():
+                f.write(_format_line(key, fingerprint))
+        os.replace(tmp_path, self._path)
+        metrics.add("cache_compactions")
+        _logger.debug("Compacted %s", self._path)
+
+
+class Journal:
+    """Fingerprints appended to a file as soon as they are known
+
+    Unlike the cache, which is saved when a run finishes, the journal survives a run
+    that is killed so that a later run can resume where it left off.
+    Every run appends to a file of its own in `directory`, locked while the run
+    lasts, so that concurrent runs do not interfere. The files use the same format
+    as the cache.
+
+    >>> import tempfile
+    >>> fingerprint = 64 * "0"
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     directory = pathlib.Path(tmp, "journals")
+    ...     interrupted = Journal(directory)
+    ...     interrupted.put((0, 1, 0, 0, 0), fingerprint)
+    ...     interrupted.close(finished=False)
+    ...     with Journal(directory, resume=True) as journal:
+    ...         print(journal.get((0, 1, 0, 0, 0)) == fingerprint)
+    ...     print(list(directory.iterdir()))
+    True
+    []
+
+    :param directory: Directory of the files backing the journal
+    :param resume: Read the entries left behind by earlier runs that did not finish,
+        if any. Their files are removed when this run finishes, unless they are
+        still in use.
+    :param writable: Append entries to a file, otherwise they are only kept in
+        memory.
+    """
+
+    def __init__(
+        self, directory: pathlib.Path, resume: bool = False, writable: bool = True
+    ) -> None:
+        self._entries: Dict[StatKey, str] = {}
+        self._lock = threading.Lock()
+        # Files of earlier runs that this run will remove when it finishes
+        self._adopted: List[Tuple[pathlib.Path, TextIO]] = []
+        if resume:
+            self._load(directory, adopt=writable)
+
+        self._path: Optional[pathlib.Path] = None
+        self._file: Optional[TextIO] = None
+        if writable:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._path = directory / f"{os.getpid()}.{time.time_ns()}"
+            self._file = self._path.open("x")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def _load(self, directory: pathlib.Path, adopt: bool) -> None:
+        try:
+            paths = sorted(directory.iterdir())
+        except FileNotFoundError:
+            return
+        for path in paths:
+            try:
+                f = path.open()
+            except FileNotFoundError:
+                continue
+            entries = dict(_read_entries(f))
+            if adopt and _try_lock(f):
+                self._adopted.append((path, f))
+            else:
+                # In use by another run, or not to be removed by this run
+                f.close()
+            with self._lock:
+                self._entries.update(entries)
+
+    def __enter__(self) -> Journal:
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.close(finished=exc_type is None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: StatKey) -> Optional[str]:
+        return self._entries.get(key)
+
+    def put(self, key: StatKey, fingerprint: str) -> None:
+        if self._file is None:
+            return
+        with self._lock:
+            # Flushed so that the entry survives the process being killed
+            self._file.write(_format_line(key, fingerprint))
+            self._file.flush()
+
+    def close(self, finished: bool) -> None:
+        """Close the journal, removing its files if the run it belongs to `finished`"""
+        files = list(self._adopted)
+        if self._file is not None and self._path is not None:
+            files.append((self._path, self._file))
+        self._adopted = []
+        self._file = None
+
+        for path, f in files:
+            if finished:
+                # Removed before unlocking so that no other run adopts it meanwhile
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            f.close()
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import re
+import stat
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+_PRUNED_NAMES = (".git",)
+
+
+class Entry:
+    """A path and, lazily, its :py:func:`os.lstat` result
+
+    Mirrors the parts of :py:class:`os.DirEntry` that are used downstream so that
+    information obtained while walking a directory is not requested again.
+    """
+
+    __slots__ = ("parent", "name", "_path", "_dir_entry", "_lstat")
+
+    def __init__(
+        self,
+        parent: pathlib.Path,
+        name: str,
+        dir_entry: Optional[os.DirEntry] = None,
+    ) -> None:
+        self.parent = parent
+        self.name = name
+        self._path: Optional[pathlib.Path] = None
+        self._dir_entry = dir_entry
+        self._lstat: Optional[os.stat_result] = None
+
+    @classmethod
+    def from_path(cls, path: pathlib.Path) -> Entry:
+        entry = cls(path.parent, path.name)
+        entry._path = path
+        return entry
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self.path)!r})"
+
+    @property
+    def path(self) -> pathlib.Path:
+        if self._path is None:
+            self._path = self.parent / self.name
+        return self._path
+
+    def lstat(self) -> os.stat_result:
+        if self._lstat is None:
+            if self._dir_entry is not None:
+                self._lstat = self._dir_entry.stat(follow_symlinks=False)
+            else:
+                self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def is_symlink(self) -> bool:
+        if self._dir_entry is not None:
+            return self._dir_entry.is_symlink()
+        try:
+            return stat.S_ISLNK(self.lstat().st_mode)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+
+    def is_file(self) -> bool:
+        """Return ``True`` if the entry is a regular file, not following symlinks"""
+        if self._dir_entry is not None:
+            return self._dir_entry.is_file(follow_symlinks=False)
+        try:
+            return stat.S_ISREG(self.lstat().st_mode)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+
+    def is_dir(self) -> bool:
+        """Return ``True`` if the entry is a directory, not following symlinks"""
+        if self._dir_entry is not None:
+            return self._dir_entry.is_dir(follow_symlinks=False)
+        try:
+            return stat.S_ISDIR(self.lstat().st_mode)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+
+
+def as_entry(item: Union[pathlib.Path, Entry]) -> Entry:
+    if isinstance(item, Entry):
+        return item
+    return Entry.from_path(pathlib.Path(item))
+
+
+def scandir(directory: pathlib.Path) -> List[Entry]:
+    """Return an entry for every child of `directory`"""
+    with os.scandir(directory) as it:
+        return [Entry(directory, dir_entry.name, dir_entry) for dir_entry in it]
+
+
+def _translate_segment(segment: str) -> str:
+    parts = []
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        i += 1
+        if c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[" and "]" in segment[i + 1 :]:
+            end = segment.index("]", i + 1)
+            chars = segment[i:end].replace("\\", "\\\\")
+            if chars[0] == "!":
+                chars = "^" + chars[1:]
+            elif chars[0] == "^":
+                chars = "\\" + chars
+            parts.append(f"[{chars}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+    return "".join(parts)
+
+
+def _translate(pattern: str) -> str:
+    """Translate a glob pattern to a regular expression matching relative paths
+
+    The pattern is interpreted like by :py:meth:`pathlib.Path.glob` in Python 3.13,
+    that is ``**`` matches any number of directories and a trailing ``**`` matches
+    files too.
+
+    >>> _translate("**/*.wav")
+    '(?:[^/]+/)*[^/]*\\\\.wav'
+    >>> _translate("a/**")
+    'a(?:/[^/]+)*'
+    """
+    segments = [segment for segment in pattern.split("/") if segment not in ("", ".")]
+    regex = ""
+    for i, segment in enumerate(segments):
+        is_last = i == len(segments) - 1
+        if segment != "**":
+            regex += _translate_segment(segment) + ("" if is_last else "/")
+        elif not is_last:
+            regex += "(?:[^/]+/)*"
+        elif regex.endswith("/"):
+            regex = regex[:-1] + "(?:/[^/]+)*"
+        else:
+            regex += "[^/]+(?:/[^/]+)*"
+    return regex
+
+
+def _compile(regexes: List[str]) -> re.Pattern:
+    if not regexes:
+        return re.compile("(?!)")
+    return re.compile("|".join(f"(?:{regex})" for regex in regexes))
+
+
+class Patterns:
+    """Glob patterns compiled into one regular expression for single pass matching"""
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        patterns = list(patterns)
+        self._regex = _compile([_translate(pattern) for pattern in patterns])
+        # Patterns without ** cannot match anything deeper than their own depth
+        self.max_depth: Optional[int] = None
+        if not any("**" in pattern for pattern in patterns):
+            self.max_depth = max(
+                (pattern.count("/") + 1 for pattern in patterns), default=0
+            )
+
+    def match(self, path: str) -> bool:
+        return self._regex.fullmatch(path) is not None
+
+
+def is_pruned(path: str, excludes: Optional[Patterns] = None) -> bool:
+    """Return ``True`` if entries at the relative `path` are skipped by :py:func:`walk`
+
+    :param excludes: Patterns passed as `excludes` to :py:func:`walk`, if any
+    """
+    if os.path.basename(path) in _PRUNED_NAMES:
+        return True
+    return excludes is not None and excludes.match(path)
+
+
+def walk(
+    top: pathlib.Path,
+    excludes: Sequence[str] = (),
+    follow_symlinks: bool = False,
+    prune: Optional[Callable[[Entry], bool]] = None,
+) -> Iterator[Entry]:
+    """Yield an entry for every descendant of `top`
+
+    Entries named ``.git``, or whose path relative to `top` matches any of the glob
+    patterns in `excludes`, are neither yielded nor descended into.
+    Directories that cannot be listed are silently skipped, like in
+    :py:meth:`pathlib.Path.rglob`.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     top = pathlib.Path(tmp)
+    ...     (top / "a" / "e").mkdir(parents=True)
+    ...     (top / ".git").mkdir()
+    ...     (top / "a" / "e" / "f").touch()
+    ...     (top / "a" / "la").symlink_to("..")
+    ...     sorted(str(e.path.relative_to(top)) for e in walk(top, follow_symlinks=True))
+    ['a', 'a/e', 'a/e/f', 'a/la']
+
+    :param top: Directory to walk
+    :param excludes: Glob patterns, see :py:class:`Patterns`, matched against the
+        path of each entry relative to `top`
+    :param follow_symlinks: Descend into symlinks to directories, each directory is
+        still descended into at most once.
+    :param prune: Called with every directory entry that would be descended into,
+        return ``True`` to skip its descendants.
+    """
+    visited: Set[Tuple[int, int]] = set()
+    if follow_symlinks:
+        try:
+            st = os.stat(top)
+        except OSError:
+            return
+        visited.add((st.st_dev, st.st_ino))
+
+    excluded = Patterns(excludes) if excludes else None
+    prefix_len = len(os.path.join(os.fspath(top), ""))
+    pending: List[pathlib.Path] = [top]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                dir_entries = list(it)
+        except OSError:
+            continue
+
+        relative = os.path.join(os.fspath(directory), "")[prefix_len:]
+        for dir_entry in dir_entries:
+            if is_pruned(relative + dir_entry.name, excluded):
+                continue
+
+            entry = Entry(directory, dir_entry.name, dir_entry)
+            yield entry
+
+            if follow_symlinks:
+                try:
+                    if not dir_entry.is_dir():
+                        continue
+                    st = dir_entry.stat()
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+            elif not dir_entry.is_dir(follow_symlinks=False):
+                continue
+
+            if prune is not None and prune(entry):
+                continue
+
+            if follow_symlinks:
+                visited.add((st.st_dev, st.st_ino))
+            pending.append(entry.path)
@@ -0,0 +1,29 @@
+import logging
+
+from lazylfs import pathutils
+
+_logger = logging.getLogger(__name__)
+
+
+class File(str):
+    pass
+
+
+class Link(str):
+    pass
+
+
+def create_tree(path, spec, ignored_exceptions=()):
+    try:
+        if isinstance(spec, dict):
+            path.mkdir(exist_ok=True)
+            for name in spec:
+                create_tree(path / name, spec[name], ignored_exceptions)
+        elif isinstance(spec, File):
+            pathutils.ensure_reg(path, spec)
+        elif isinstance(spec, Link):
+            pathutils.ensure_lnk(path, spec)
+        else:
+            raise ValueError
+    except ignored_exceptions as e:
+        _logger.debug("Ignoring exception %s", str(e))
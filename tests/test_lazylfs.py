@@ -4,30 +4,25 @@ This is for pytest to find and stop being upset not finding any tests.
 >>> 'Happy?'[:-1]
 'Happy'
 """
+
 import collections
 import contextlib
 import functools
+import hashlib
+import json
 import logging
 import os
 import pathlib
 import stat
 import subprocess
+import sys
+import time
 from typing import Collection, Dict
 
 import pytest
 
-from lazylfs import cli, pathutils
-
-_logger = logging.getLogger(__name__)
-
-
-class File(str):
-    pass
-
-
-class Link(str):
-    pass
-
+from conftest import File, Link, create_tree
+from lazylfs import cli, content, location, statcache
 
 _SAMPLE_TREE = {
     "a": {
@@ -51,22 +46,6 @@ _SAMPLE_TREE = {
 }
 
 
-def _create_tree(path, spec, ignored_exceptions=()):
-    try:
-        if isinstance(spec, dict):
-            path.mkdir(exist_ok=True)
-            for name in spec:
-                _create_tree(path / name, spec[name], ignored_exceptions)
-        elif isinstance(spec, File):
-            pathutils.ensure_reg(path, spec)
-        elif isinstance(spec, Link):
-            pathutils.ensure_lnk(path, spec)
-        else:
-            raise ValueError
-    except ignored_exceptions as e:
-        _logger.debug("Ignoring exception %s", str(e))
-
-
 _SAMEFILE_ATTRS = {
     "st_ino",
     "st_dev",
@@ -122,7 +101,7 @@ def assert_nullipotent(path):
 @pytest.fixture()
 def base_legacy(tmp_path):
     legacy_path = tmp_path / "legacy"
-    _create_tree(legacy_path, _SAMPLE_TREE)
+    create_tree(legacy_path, _SAMPLE_TREE)
     yield legacy_path
 
 
@@ -133,7 +112,7 @@ def base_repo(tmp_path, base_legacy):
     cli.link(base_legacy / "a", repo_path / "a")
     cli.track(repo_path)
 
-    _create_tree(repo_path / "a", _SAMPLE_TREE["a"], FileExistsError)
+    create_tree(repo_path / "a", _SAMPLE_TREE["a"], FileExistsError)
 
     (repo_path / "a/reg").touch()
     (repo_path / "a/dir").mkdir()
@@ -172,6 +151,97 @@ def test_link_skips_if_existing_and_same(tmp_path, base_legacy):
         cli.link(base_legacy / "a", repo_path / "a")
 
 
+def test_link_is_independent_of_jobs(tmp_path, base_legacy):
+    cli.link(base_legacy / "a", tmp_path / "serial")
+    cli.link(base_legacy / "a", tmp_path / "parallel", jobs=4)
+
+    def _links(top):
+        return {
+            str(path.relative_to(top)): os.readlink(path)
+            for path in top.rglob("*")
+            if path.is_symlink()
+        }
+
+    assert _links(tmp_path / "serial") == _links(tmp_path / "parallel")
+    with assert_nullipotent(tmp_path / "parallel"):
+        cli.link(base_legacy / "a", tmp_path / "parallel", jobs=4)
+
+
+def test_incremental_link_lists_only_changed_directories(
+    tmp_path, base_legacy, monkeypatch, capsys, caplog
+):
+    # Otherwise every directory would be too new to be trusted
+    monkeypatch.setattr(location, "_RACY_NS", 0)
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    src = base_legacy / "a"
+
+    def _link(**kwargs):
+        cli.link(src, repo_path / "a", incremental=True, stats="json", **kwargs)
+        return json.loads(capsys.readouterr().err)["counts"]
+
+    assert (
+        _link()["directories_listed"]
+        == len(
+            [path for path in src.rglob("*") if path.is_dir() and not path.is_symlink()]
+        )
+        + 1
+    )
+    assert _link()["directories_listed"] == 0
+    cli.track(str(repo_path))
+
+    (src / "e/i").write_text("India")
+    counts = _link()
+    assert counts["directories_listed"] == 1
+    assert counts["links_created"] == 1
+    assert (repo_path / "a/e/i").resolve() == src / "e/i"
+
+    (src / "e/i").unlink()
+    with caplog.at_level(logging.WARNING):
+        _link()
+    assert str(repo_path / "a/e/i") in caplog.text
+    assert (repo_path / "a/e/i").is_symlink()
+
+    (src / "e/f").unlink()
+    (src / "e").rmdir()
+    _link(prune=True)
+    assert not (repo_path / "a/e/i").is_symlink()
+    assert not (repo_path / "a/e/f").is_symlink()
+    cli.check(str(repo_path))
+
+
+def test_incremental_link_into_repo_root(tmp_path, base_legacy, monkeypatch):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    monkeypatch.chdir(repo_path)
+
+    cli.link(base_legacy / "a", ".", incremental=True)
+    assert (repo_path / "e/f").resolve() == base_legacy / "a/e/f"
+    assert list((repo_path / ".git/lazylfs/link").iterdir())
+
+
+def test_link_accepts_includes_as_list(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    src = str(base_legacy / "a")
+
+    cli.main(["link", src, str(repo_path / "b"), '["e/*", "h"]'])
+    cli.main(["link", src, str(repo_path / "c"), '--includes=["e/*", "h"]'])
+    for dst in [repo_path / "b", repo_path / "c"]:
+        assert (dst / "e/f").is_symlink()
+        assert (dst / "h").is_symlink()
+        assert not (dst / "g").exists()
+
+
+def test_incremental_link_accepts_iterators(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    location.link(
+        base_legacy / "a", repo_path / "a", iter(["**/*"]), iter([]), incremental=True
+    )
+    assert (repo_path / "a/g").is_symlink()
+
+
 def test_link_does_not_affect_src(tmp_path, base_legacy):
     repo_path = tmp_path / "repo"
     repo_path.mkdir()
@@ -213,7 +283,7 @@ def test_common_paths_resolve_to_samefile_after_link(tmp_path, base_legacy):
 
 def test_link_ignores_files_not_matching_include(tmp_path, base_legacy):
     repo_path = tmp_path / "repo"
-    cli.link(base_legacy, repo_path, ("*/g", "**/f"))
+    cli.link(base_legacy, repo_path, "*/g", "**/f")
 
     actual = collections.Counter(
         str(path.relative_to(repo_path)) for path in repo_path.rglob("*")
@@ -228,6 +298,81 @@ def test_link_ignores_files_not_matching_include(tmp_path, base_legacy):
     assert actual == expected
 
 
+@pytest.mark.parametrize(
+    "includes",
+    [("**/*",), ("*/g", "**/f"), ("a/*",), ("**/[gh]", "**/j"), ("i/?",), ("k",)],
+)
+def test_link_includes_same_files_as_glob(tmp_path, base_legacy, includes):
+    repo_path = tmp_path / "repo"
+    cli.link(base_legacy, repo_path, *includes)
+
+    expected = {
+        path.relative_to(base_legacy)
+        for include in includes
+        for path in base_legacy.glob(include)
+        if path.is_file() and not path.is_symlink()
+    }
+    actual = {
+        path.relative_to(repo_path)
+        for path in repo_path.rglob("*")
+        if path.is_symlink()
+    }
+    assert actual == expected
+
+
+def test_link_ignores_files_matching_exclude(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    cli.link(base_legacy, repo_path, "**/*", excludes=("a/e", "**/[jk]"))
+
+    actual = {
+        str(path.relative_to(repo_path))
+        for path in repo_path.rglob("*")
+        if path.is_symlink()
+    }
+    assert actual == {"a/g", "a/h"}
+
+
+def test_check_excludes_paths_like_link(base_repo):
+    (base_repo / "a/e/f").resolve().write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.check(base_repo, excludes=["e"])
+    cli.check(base_repo, excludes=["a/e"])
+    cli.check(base_repo, excludes=["**/e"])
+
+
+def test_link_traverses_src_once(tmp_path, base_legacy, monkeypatch):
+    scandir = os.scandir
+    listed: collections.Counter = collections.Counter()
+
+    def _scandir(path):
+        listed[os.fspath(path)] += 1
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", _scandir)
+    cli.link(base_legacy, tmp_path / "repo", "**/f", "**/g", "**/j")
+
+    assert listed
+    assert set(listed.values()) == {1}
+
+
+def test_link_from_command_line_takes_any_number_of_includes(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    cli.main(["link", str(base_legacy), str(repo_path), "**/f", "**/g", "**/j"])
+    linked = {path.name for path in repo_path.rglob("*") if path.is_symlink()}
+    assert linked == {"f", "g", "j"}
+
+
+def test_collect_paths_yields_each_path_once(base_legacy, monkeypatch):
+    monkeypatch.chdir(base_legacy)
+    includes = ("a/e", "a/g", "a", "a/e/f", "i", "a")
+    actual = collections.Counter(entry.path for entry in cli._collect_paths(includes))
+
+    expected = {pathlib.Path(path) for path in ["a", "i", "a/e", "a/e/f", "a/g"]}
+    assert set(actual.values()) == {1}
+    assert expected <= set(actual)
+    assert not any(path.parts[0] == "k" for path in actual)
+
+
 def test_track_is_idempotent(tmp_path, base_legacy):
     repo_path = tmp_path / "repo"
     repo_path.mkdir()
@@ -238,6 +383,464 @@ def test_track_is_idempotent(tmp_path, base_legacy):
         cli.track(repo_path)
 
 
+def test_track_is_independent_of_jobs(tmp_path, base_legacy):
+    def _track(name, jobs):
+        repo_path = tmp_path / name
+        repo_path.mkdir()
+        cli.link(base_legacy / "a", repo_path / "a")
+        cli.track(repo_path, jobs=jobs)
+        return {
+            str(path.relative_to(repo_path)): sorted(path.read_text().splitlines())
+            for path in repo_path.rglob(".shasum")
+        }
+
+    assert _track("sequential", 1) == _track("parallel", 4)
+
+
+@pytest.mark.parametrize("page_cache", ["drop", "direct"])
+def test_check_passes_regardless_of_page_cache_policy(base_repo, page_cache):
+    cli.check(base_repo, cache=False, page_cache=page_cache)
+    (base_repo / "a/g").resolve().write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.check(base_repo, cache=False, page_cache=page_cache)
+
+
+def test_track_writes_sorted_index(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    cli.link(base_legacy / "a", repo_path / "a")
+    cli.track(repo_path)
+
+    names = [line.split()[-1] for line in (repo_path / "a/.shasum").open()]
+    assert names == sorted(names)
+
+
+def test_track_does_not_modify_index_on_conflict(base_repo):
+    (base_repo / "a/g").resolve().write_text("stone")
+    (base_repo / "a/x").symlink_to((base_repo / "a/h").resolve())
+
+    with assert_nullipotent(base_repo), pytest.raises(TypeError):
+        cli.track(base_repo)
+
+
+def test_track_with_other_algorithm(base_repo):
+    (base_repo / "a/x").symlink_to((base_repo / "a/h").resolve())
+    cli.track(base_repo, algorithm="blake2b")
+
+    index = dict(reversed(line.split()) for line in (base_repo / "a/.shasum").open())
+    assert ":" not in index["g"]
+    assert index["x"].startswith("blake2b:")
+
+    with assert_nullipotent(base_repo):
+        cli.track(base_repo, algorithm="blake2b")
+        cli.track(base_repo)
+        cli.check(base_repo)
+
+    (base_repo / "a/h").resolve().write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.check(base_repo / "a/x")
+
+
+def test_check_quick_reads_only_quick_fingerprints(base_repo, monkeypatch):
+    cli.track(base_repo, quick=True)
+
+    # The first and last fields keep their meaning for other readers of the index
+    index = dict(line.split()[::-2] for line in (base_repo / "a/.shasum").open())
+    expected = hashlib.sha256((base_repo / "a/g").read_bytes()).hexdigest()
+    assert index["g"] == expected
+    with assert_nullipotent(base_repo):
+        cli.track(base_repo)
+        cli.track(base_repo, quick=True)
+
+    def _hexdigest(path, *args):
+        raise AssertionError("Expected no files to be hashed")
+
+    with monkeypatch.context() as m:
+        m.setattr(content, "_hexdigest", _hexdigest)
+        cli.check(base_repo, quick=True, cache=False)
+        with pytest.raises(AssertionError):
+            cli.check(base_repo, cache=False)
+        with pytest.raises(AssertionError):
+            cli.check(base_repo, quick=True, full=True, cache=False)
+
+    # A quick fingerprint that differs is confirmed by hashing in full
+    index_path = base_repo / "a/.shasum"
+    index_path.write_text(index_path.read_text().replace("quick:4:", "quick:4:0"))
+    cli.check(base_repo / "a/g", quick=True)
+
+    (base_repo / "a/g").resolve().write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.check(base_repo / "a/g", quick=True)
+
+
+def test_write_index_keeps_permissions_and_cleans_up(tmp_path):
+    path = tmp_path / ".shasum"
+    path.write_text("")
+    path.chmod(0o640)
+    content._write_index(path, {"a": content._IndexEntry(64 * "0", None)})
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+    with pytest.raises(TypeError):
+        content._write_index(path, {"b": content._IndexEntry(0, None)})
+    assert os.listdir(tmp_path) == [".shasum"]
+    assert path.read_text() == f"{64 * '0'}  a\n"
+
+
+def test_since_considers_only_changes(base_repo, monkeypatch):
+    git = functools.partial(subprocess.run, cwd=base_repo, check=True)
+    git(["git", "init", "-q"])
+    git(["git", "add", "."])
+    git(["git", "-c", "user.name=a", "-c", "user.email=a@b", "commit", "-qm", "a"])
+    monkeypatch.chdir(base_repo)
+
+    # Changes to the data outside of git are not considered
+    (base_repo / "a/g").resolve().write_text("stone")
+    cli.check(since="HEAD")
+    cli.check(base_repo / "a", since="HEAD")
+
+    (base_repo / "a/x").symlink_to((base_repo / "a/h").resolve())
+    with pytest.raises(cli.NotOkError):
+        cli.check(since="HEAD")
+    cli.check(base_repo / "a/e", since="HEAD")
+
+    cli.track(since="HEAD")
+    cli.check(since="HEAD")
+
+    index_path = base_repo / "a/e/.shasum"
+    index_path.write_text(index_path.read_text().replace("f", "g"))
+    with pytest.raises(cli.NotOkError):
+        cli.check(base_repo / "a/e", since="HEAD")
+
+
+def test_since_reports_bad_revisions(base_repo, monkeypatch, capsys):
+    subprocess.run(["git", "init", "-q"], cwd=base_repo, check=True)
+    monkeypatch.chdir(base_repo)
+    with pytest.raises(SystemExit) as exc_info:
+        cli.main(["check", "--since", "nope"])
+    assert exc_info.value.code == 2
+    assert "lazylfs check: Invalid --since nope: fatal:" in capsys.readouterr().err
+
+
+def test_stats_are_printed_to_stderr(base_repo, capsys):
+    cli.check(base_repo, stats="json", cache=False)
+    out, err = capsys.readouterr()
+    assert not out
+    stats = json.loads(err)
+    assert stats["counts"]["files_hashed"] == 3
+    assert stats["counts"]["indexes_read"] == 2
+    assert "walk" not in stats["counts"]
+    assert stats["counts"]["entries_walked"] > 0
+    assert {"walk", "hash", "read_index", "total"} <= set(stats["seconds"])
+
+    # The same target is hashed once
+    (base_repo / "a/golf").symlink_to((base_repo / "a/g").resolve())
+    cli.track(base_repo / "a/golf")
+    cli.check(base_repo / "a/g", base_repo / "a/golf", stats="json", cache=False)
+    counts = json.loads(capsys.readouterr().err)["counts"]
+    assert counts["bytes_avoided"] == len("golf")
+
+    cli.check(base_repo)
+    assert capsys.readouterr() == ("", "")
+
+
+def test_progress_is_shown_only_when_asked_for(base_repo, capsys, monkeypatch):
+    monkeypatch.setattr(sys.stderr, "isatty", lambda: True)
+    cli.check(base_repo)
+    assert capsys.readouterr() == ("", "")
+
+    num_paths = len(list(cli._collect_paths((str(base_repo),))))
+    cli.check(base_repo, progress=True, cache=False)
+    out, err = capsys.readouterr()
+    assert not out
+    assert err.endswith("\n")
+    assert f"{num_paths}/{num_paths} files" in err.splitlines()[-1]
+
+
+def test_database_mirrors_indexes(tmp_path, base_legacy, capsys):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    cli.track(repo_path, database=True)
+
+    cli.check(repo_path, database=True, stats="json")
+    stats = json.loads(capsys.readouterr().err)
+    assert stats["counts"]["indexes_from_database"] == 2
+
+    cli.query(repo_path, under=base_legacy / "a/e")
+    assert capsys.readouterr().out.split() == [str(repo_path / "a/e/f")]
+    cli.query(repo_path, under=base_legacy, size=True)
+    targets = {path.resolve() for path in repo_path.rglob("*") if path.is_symlink()}
+    expected = sum(target.stat().st_size for target in targets)
+    assert capsys.readouterr().out == f"{expected}\n"
+
+    # Indexes that change behind its back are read again
+    index_path = repo_path / "a/e/.shasum"
+    index_path.write_text(index_path.read_text().replace("f", "g"))
+    with pytest.raises(cli.NotOkError):
+        cli.check(repo_path, database=True)
+    index_path.unlink()
+    cli.query(repo_path, under=base_legacy / "a/e")
+    assert not capsys.readouterr().out
+
+
+def test_database_is_independent_of_working_directory(
+    tmp_path, base_legacy, capsys, monkeypatch
+):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    monkeypatch.chdir(repo_path)
+    cli.track(".", database=True)
+
+    monkeypatch.chdir(tmp_path)
+    cli.check("repo", database=True, stats="json")
+    stats = json.loads(capsys.readouterr().err)
+    assert stats["counts"]["indexes_from_database"] == 2
+
+    monkeypatch.chdir(repo_path / "a")
+    cli.query(under=base_legacy / "a/e")
+    assert capsys.readouterr().out.split() == [str(repo_path / "a/e/f")]
+
+
+def test_check_with_jobs(base_repo):
+    with assert_nullipotent(base_repo):
+        cli.check(base_repo, jobs=4)
+
+    (base_repo / "a/g").resolve().write_text("stone")
+
+    with assert_nullipotent(base_repo):
+        with pytest.raises(cli.NotOkError):
+            cli.check(base_repo, jobs=4)
+        cli.check(base_repo / "a/e", jobs=4)
+
+
+def test_check_with_processes(base_repo):
+    with assert_nullipotent(base_repo):
+        cli.check(base_repo, processes=2)
+
+    (base_repo / "a/g").resolve().write_text("stone")
+
+    with assert_nullipotent(base_repo):
+        with pytest.raises(cli.NotOkError):
+            cli.check(base_repo, processes=2)
+        cli.check(base_repo / "a/e", processes=2)
+
+
+def test_check_with_concurrency_overlaps_slow_reads(tmp_path, monkeypatch):
+    legacy_path = tmp_path / "legacy"
+    create_tree(legacy_path, {str(i): File(str(i)) for i in range(32)})
+    repo_path = tmp_path / "repo"
+    cli.link(legacy_path, repo_path)
+    cli.track(repo_path)
+
+    open_ = content._open
+    latency = 0.1
+
+    def _open(path):
+        time.sleep(latency)
+        return open_(path)
+
+    monkeypatch.setattr(content, "_open", _open)
+    links = [repo_path / str(i) for i in range(32)]
+
+    start = time.monotonic()
+    cli.check(*links, cache=False, concurrency=16)
+    assert time.monotonic() - start < len(links) * latency / 4
+
+    (legacy_path / "7").write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.check(*links, cache=False, concurrency=16)
+
+
+def test_check_trusting_cache_skips_unchanged_targets(
+    tmp_path, base_legacy, monkeypatch
+):
+    # Otherwise every target would be too new to be cached
+    monkeypatch.setattr(content, "_RACY_NS", 0)
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    cli.track(repo_path)
+    assert (repo_path / ".git/lazylfs/cache").read_text()
+
+    def _hexdigest(path, *args):
+        raise AssertionError("Expected no files to be hashed")
+
+    with monkeypatch.context() as m:
+        m.setattr(content, "_hexdigest", _hexdigest)
+        cli.check(repo_path, trust_cache=True)
+        with pytest.raises(AssertionError):
+            cli.check(repo_path)
+        with pytest.raises(AssertionError):
+            cli.check(repo_path, cache=False, trust_cache=True)
+
+    (base_legacy / "a/g").write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.check(repo_path, trust_cache=True)
+
+
+def test_recently_modified_targets_are_not_cached(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    cli.track(repo_path)
+    assert not (repo_path / ".git/lazylfs/cache").exists()
+
+
+@pytest.mark.parametrize("command", [cli.track, cli.check])
+def test_resume_skips_targets_hashed_before_interruption(
+    tmp_path, base_legacy, monkeypatch, command
+):
+    monkeypatch.setattr(content, "_RACY_NS", 0)
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    if command is cli.check:
+        cli.track(repo_path)
+
+    hexdigest = content._hexdigest
+    hashed = []
+
+    def _interrupted_hexdigest(path, *args):
+        if hashed:
+            raise KeyboardInterrupt
+        hashed.append(path)
+        return hexdigest(path, *args)
+
+    with monkeypatch.context() as m:
+        m.setattr(content, "_hexdigest", _interrupted_hexdigest)
+        with pytest.raises(KeyboardInterrupt):
+            command(repo_path)
+
+    def _counting_hexdigest(path, *args):
+        hashed.append(path)
+        return hexdigest(path, *args)
+
+    journal_path = repo_path / ".git/lazylfs/journals"
+    assert list(journal_path.iterdir())
+    hashed.clear()
+    with monkeypatch.context() as m:
+        m.setattr(content, "_hexdigest", _counting_hexdigest)
+        command(repo_path, resume=True)
+    assert len(hashed) == 2
+    assert not list(journal_path.iterdir())
+    cli.check(repo_path)
+
+
+def test_resume_in_processes_removes_journals(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    cli.track(repo_path)
+    journals_path = repo_path / ".git/lazylfs/journals"
+    statcache.Journal(journals_path).close(finished=False)
+
+    cli.check(repo_path, resume=True, processes=2)
+    assert not list(journals_path.iterdir())
+
+
+def test_resume_ignores_incomplete_journal_entries(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    key = statcache.stat_key(os.stat(repo_path / "a/g"))
+    journals_path = repo_path / ".git/lazylfs/journals"
+    journals_path.mkdir(parents=True)
+    (journals_path / "1.1").write_text(" ".join(map(str, key)) + " 5891b5b5")
+
+    cli.track(repo_path, resume=True)
+    index = dict(reversed(line.split()) for line in (repo_path / "a/.shasum").open())
+    assert index["g"] == hashlib.sha256(b"golf").hexdigest()
+
+
+@pytest.mark.parametrize("command", [cli.track, cli.check])
+@pytest.mark.parametrize("jobs", [1, 8])
+def test_each_index_is_read_once(base_repo, monkeypatch, command, jobs):
+    read_index = content._read_index
+    reads: collections.Counter = collections.Counter()
+
+    def _read_index(path):
+        reads[path] += 1
+        # Gives other threads a chance to read the same index meanwhile
+        time.sleep(0.01)
+        return read_index(path)
+
+    monkeypatch.setattr(content, "_read_index", _read_index)
+    command(base_repo, jobs=jobs)
+
+    assert reads
+    assert set(reads.values()) == {1}
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_check_reads_each_target_once(base_repo, monkeypatch, jobs):
+    for name in "xyz":
+        (base_repo / "a" / name).symlink_to((base_repo / "a/g").resolve())
+    cli.track(base_repo)
+
+    hexdigest = content._hexdigest
+    reads: collections.Counter = collections.Counter()
+
+    def _hexdigest(path, *args):
+        reads[path.resolve()] += 1
+        return hexdigest(path, *args)
+
+    monkeypatch.setattr(content, "_hexdigest", _hexdigest)
+    cli.check(base_repo, jobs=jobs)
+
+    assert reads[(base_repo / "a/g").resolve()] == 1
+    assert set(reads.values()) == {1}
+
+
+def test_check_streams_reasons_as_ndjson(base_repo, capsys):
+    (base_repo / "a/g").resolve().write_text("stone")
+    (base_repo / "a/h").unlink()
+    (base_repo / "a/e/x").symlink_to((base_repo / "a/e/f").resolve())
+
+    with pytest.raises(cli.NotOkError):
+        cli.check(
+            base_repo / "a/.shasum",
+            base_repo / "a/e/.shasum",
+            base_repo / "a/g",
+            base_repo / "a/h",
+            base_repo / "a/e/f",
+            base_repo / "a/e/x",
+            ndjson=True,
+        )
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    actual = {
+        str(pathlib.Path(record["path"]).relative_to(base_repo)): record["reason"]
+        for record in records
+    }
+    assert actual == {
+        "a/.shasum": "missing",
+        "a/e/.shasum": "extra",
+        "a/g": "mismatch",
+        "a/h": "missing",
+        "a/e/f": None,
+        "a/e/x": "extra",
+    }
+    assert all(
+        (record["status"] == "ok") == (record["reason"] is None) for record in records
+    )
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_check_fail_fast_stops_at_first_nok(base_repo, jobs):
+    (base_repo / "a/g").resolve().write_text("stone")
+    paths = [base_repo / "a/g"] + [base_repo / "a/e/f"] * 100
+    results = []
+
+    with pytest.raises(cli.NotOkError):
+        content.check(
+            paths,
+            jobs=jobs,
+            fail_fast=True,
+            on_result=lambda path, reason: results.append((path, reason)),
+        )
+    assert results == [(base_repo / "a/g", "mismatch")]
+
+
 def test_check_on_clean_repo(base_repo):
     with assert_nullipotent(base_repo):
         cli.check(base_repo)
@@ -369,7 +972,7 @@ def test_check_added_lnk_new_dir(base_repo):
 
 def test_workflow_cli(tmp_path):
     legacy_path = tmp_path / "legacy"
-    _create_tree(legacy_path, _SAMPLE_TREE)
+    create_tree(legacy_path, _SAMPLE_TREE)
 
     repo_path = tmp_path / "repo"
     repo_path.mkdir()
@@ -407,3 +1010,175 @@ def test_workflow_cli(tmp_path):
     )
     assert not proc.stdout
     assert proc.returncode
+
+
+def test_cli_imports_only_what_checking_needs():
+    # Hooks run the command line interface once per commit, or even per path, so
+    # modules that are slow to import and not needed by every command must be
+    # imported lazily.
+    code = (
+        "import sys; before = set(sys.modules); import lazylfs.cli;"
+        "print(*set(sys.modules) - before)"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    imported = set(proc.stdout.split())
+    assert "lazylfs.content" in imported
+    assert not imported & {
+        "asyncio",
+        "fire",
+        "json",
+        "lazylfs.indexdb",
+        "lazylfs.location",
+        "sqlite3",
+        "subprocess",
+    }
+
+
+def test_main_parses_arguments_without_fire(base_repo, capsys):
+    cli.main(["check", str(base_repo), "--nocache", "--jobs", "2", "--ndjson"])
+    assert '"status": "ok"' in capsys.readouterr().out
+    cli.main(["check", str(base_repo), "--no-cache"])
+    cli.main(["check", "--stats", "json", str(base_repo)])
+    assert "counts" in json.loads(capsys.readouterr().err)
+
+    (base_repo / "a/g").resolve().write_text("stone")
+    with pytest.raises(cli.NotOkError):
+        cli.main(["check", "--excludes=e", str(base_repo / "a")])
+    assert cli._parse_args(cli.check, ['--excludes=["e", "g"]', "--excludes=h"]) == (
+        [],
+        {"excludes": ["e", "g", "h"]},
+    )
+
+    for args in [["check", "--jobs"], ["check", "--colour"], ["link", "src"]]:
+        with pytest.raises(SystemExit) as exc_info:
+            cli.main(args)
+        assert exc_info.value.code == 2
+
+
+def test_service_reuses_fingerprints_between_batches(monkeypatch, base_repo):
+    monkeypatch.setattr(content, "_RACY_NS", 0)
+    hexdigest = content._hexdigest
+    hashed = []
+
+    def _counting_hexdigest(path, *args):
+        hashed.append(path)
+        return hexdigest(path, *args)
+
+    monkeypatch.setattr(content, "_hexdigest", _counting_hexdigest)
+    with content.Service(cache=False) as service:
+        assert not any(reason for _, reason in service.check([base_repo / "a/g"]))
+        num_hashed = len(hashed)
+        assert num_hashed
+        assert not any(reason for _, reason in service.check([base_repo / "a/g"]))
+        assert len(hashed) == num_hashed
+
+        (base_repo / "a/g").resolve().write_text("stone")
+        assert service.check([base_repo / "a/g"]) == [
+            (base_repo / "a/g", content.MISMATCH)
+        ]
+
+
+def test_service_rehashes_recently_modified_files(monkeypatch, base_repo):
+    hexdigest = content._hexdigest
+    hashed = []
+
+    def _counting_hexdigest(path, *args):
+        hashed.append(path)
+        return hexdigest(path, *args)
+
+    monkeypatch.setattr(content, "_hexdigest", _counting_hexdigest)
+    with content.Service(cache=False) as service:
+        service.check([base_repo / "a/g"])
+        service.check([base_repo / "a/g"])
+    assert len(hashed) == 2
+
+
+def test_session_forgets_least_recently_used_fingerprints():
+    computed = []
+
+    def _memoize(session, mtime_ns):
+        key = ((0, 0, 0, mtime_ns, 0), "sha256")
+        return session.memoize(key, 1, lambda: computed.append(mtime_ns) or "")
+
+    session = content._Session(cache=False, memo_size=2)
+    for mtime_ns in [1, 2, 1, 3, 2]:
+        _memoize(session, mtime_ns)
+    assert computed == [1, 2, 3, 2]
+
+    session.forget_racy(3)
+    for mtime_ns in [1, 2, 3]:
+        _memoize(session, mtime_ns)
+    assert computed == [1, 2, 3, 2, 1, 3]
+
+
+def test_service_rereads_changed_indexes(base_repo):
+    index_path = base_repo / "a/.shasum"
+    with content.Service(cache=False) as service:
+        assert not any(reason for _, reason in service.check([base_repo / "a/g"]))
+
+        lines = index_path.read_text().splitlines(keepends=True)
+        index_path.write_text(
+            "".join(line for line in lines if line.split()[-1] != "g")
+        )
+        assert service.check([base_repo / "a/g"]) == [
+            (base_repo / "a/g", content.EXTRA)
+        ]
+
+        service.track([base_repo / "a/g"])
+        assert "g" in index_path.read_text().split()
+        assert not any(reason for _, reason in service.check([base_repo / "a"]))
+
+
+def test_service_rereads_changed_index_once(base_repo, monkeypatch):
+    read_index = content._read_index
+    reads = []
+
+    def _read_index(path):
+        reads.append(path)
+        return read_index(path)
+
+    monkeypatch.setattr(content, "_read_index", _read_index)
+    index_path = base_repo / "a/.shasum"
+    with content.Service(cache=False) as service:
+        service.check([index_path])
+        assert len(reads) == 1
+
+        # Changes the stat identity of the index like an edit would
+        os.utime(index_path, ns=(0, 0))
+        for _ in range(5):
+            service.check([index_path])
+    assert len(reads) == 2
+
+
+def test_serve_cli(base_repo):
+    (base_repo / "a/g").resolve().write_text("stone")
+    proc = subprocess.run(
+        ["lazylfs", "serve", "--framing=newline", "--nocache"],
+        cwd=base_repo,
+        input="check a/h\ncheck a/g\n",
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert [json.loads(line) for line in proc.stdout.splitlines()] == [
+        {"status": "ok", "results": []},
+        {"status": "nok", "results": [{"path": "a/g", "reason": "mismatch"}]},
+    ]
+
+
+def test_concurrent_runs_keep_separate_journals(tmp_path, base_legacy):
+    repo_path = tmp_path / "repo"
+    (repo_path / ".git").mkdir(parents=True)
+    cli.link(base_legacy / "a", repo_path / "a")
+    cli.track(repo_path)
+    journals_path = repo_path / ".git/lazylfs/journals"
+
+    with content.Service() as service:
+        service.check([repo_path / "a/g"])
+        assert len(list(journals_path.iterdir())) == 1
+        cli.check(repo_path)
+        assert len(list(journals_path.iterdir())) == 1
+        service.check([repo_path / "a/g"])
+    assert not list(journals_path.iterdir())
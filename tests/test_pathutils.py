@@ -1,7 +1,6 @@
-import pathlib
-
 import pytest
 
+from conftest import File, Link, create_tree
 from lazylfs import pathutils
 
 _SAMEFILE_ATTRS = {
@@ -12,28 +11,6 @@ _SAMEFILE_ATTRS = {
 # These should be stable, st_atime notably is not
 
 
-class Link(str):
-    pass
-
-
-class File(str):
-    pass
-
-
-def create_tree(top: pathlib.Path, spec) -> None:
-    for name, sub in spec.items():
-        path = top / name
-        if isinstance(sub, dict):
-            path.mkdir()
-            create_tree(path, sub)
-        elif isinstance(sub, File):
-            path.write_text(sub)
-        elif isinstance(sub, Link):
-            path.symlink_to(sub)
-        else:
-            raise ValueError
-
-
 @pytest.mark.parametrize(
     "tree, start, nodes",
     [
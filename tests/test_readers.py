@@ -0,0 +1,64 @@
+import hashlib
+import os
+
+import pytest
+
+from lazylfs import readers
+
+_SIZES = [0, 1, readers.DEFAULT_BLOCK_SIZE, 3 * readers.DEFAULT_BLOCK_SIZE + 7]
+
+
+@pytest.mark.parametrize("size", _SIZES)
+@pytest.mark.parametrize("strategy", ["auto"] + sorted(readers.STRATEGIES))
+@pytest.mark.parametrize("block_size", [None, 4096, 1000])
+def test_read_yields_content(tmp_path, size, strategy, block_size):
+    content = os.urandom(size)
+    path = tmp_path / "f"
+    path.write_bytes(content)
+
+    h = hashlib.sha256()
+    with path.open("rb", buffering=0) as f:
+        for block in readers.read(f, strategy, block_size):
+            assert len(block) <= (block_size or len(block))
+            h.update(block)
+
+    assert h.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_choose_reads_large_files_in_large_blocks_without_mapping(tmp_path):
+    path = tmp_path / "f"
+    path.touch()
+    st = os.stat(path)
+    assert readers.choose(st) == ("readinto", readers.DEFAULT_BLOCK_SIZE)
+
+    os.truncate(path, 1024**3)
+    strategy, block_size = readers.choose(os.stat(path))
+    assert strategy == "readinto"
+    assert block_size > readers.DEFAULT_BLOCK_SIZE
+
+
+@pytest.mark.parametrize("size", _SIZES)
+@pytest.mark.parametrize("page_cache", readers.PAGE_CACHE_POLICIES)
+def test_read_yields_content_regardless_of_page_cache_policy(
+    tmp_path, size, page_cache
+):
+    content = os.urandom(size)
+    path = tmp_path / "f"
+    path.write_bytes(content)
+
+    h = hashlib.sha256()
+    with path.open("rb", buffering=0) as f:
+        for block in readers.read(f, "auto", 1000, page_cache):
+            h.update(block)
+
+    assert h.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_read_refuses_to_drop_pages_of_mapped_files(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(b"a")
+    with path.open("rb", buffering=0) as f:
+        with pytest.raises(ValueError):
+            readers.read(f, "mmap", page_cache="drop")
+        with pytest.raises(ValueError):
+            readers.read(f, page_cache="forget")
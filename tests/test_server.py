@@ -0,0 +1,71 @@
+import io
+import json
+
+import pytest
+
+from lazylfs import server
+
+
+def _handler(command, paths):
+    if "boom" in paths:
+        raise RuntimeError("boom")
+    return [(path, "mismatch") for path in paths if path.startswith("bad")]
+
+
+def _pkt_lines(*groups):
+    stream = io.BytesIO()
+    for group in groups:
+        for line in group:
+            server.write_pkt_line(stream, line)
+        server.write_pkt_line(stream, None)
+    stream.seek(0)
+    return stream
+
+
+def _read_groups(stream):
+    stream.seek(0)
+    groups = []
+    while stream.tell() < len(stream.getvalue()):
+        groups.append(server._read_group(stream))
+    return groups
+
+
+def test_serve_pkt_lines():
+    stdin = _pkt_lines(
+        ["lazylfs-client", "version=1"],
+        ["capability=check", "capability=frobnicate"],
+        ["command=check", "pathname=good", "pathname=bad=path"],
+        ["command=check", "pathname=good"],
+        ["command=check", "pathname=boom"],
+        ["command=frobnicate", "pathname=good"],
+    )
+    stdout = io.BytesIO()
+    server.serve(_handler, stdin, stdout)
+
+    assert _read_groups(stdout) == [
+        ["lazylfs-server", "version=1"],
+        ["capability=check"],
+        ["status=nok", "mismatch=bad=path"],
+        ["status=ok"],
+        ["status=error", "error=RuntimeError: boom"],
+        ["status=error", "error=Unknown command 'frobnicate'"],
+    ]
+
+
+def test_serve_pkt_lines_rejects_other_clients():
+    stdin = _pkt_lines(["git-filter-client", "version=2"])
+    with pytest.raises(server.ProtocolError):
+        server.serve(_handler, stdin, io.BytesIO())
+
+
+def test_serve_lines():
+    stdin = io.BytesIO(b"check good\ncheck bad path\ntrack boom\n")
+    stdout = io.BytesIO()
+    server.serve(_handler, stdin, stdout, "newline")
+
+    responses = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert responses == [
+        {"status": "ok", "results": []},
+        {"status": "nok", "results": [{"path": "bad path", "reason": "mismatch"}]},
+        {"status": "error", "results": [], "error": "RuntimeError: boom"},
+    ]
@@ -0,0 +1,35 @@
+from lazylfs import statcache
+
+_FINGERPRINT = 64 * "0"
+
+
+def _key(ino):
+    return 0, ino, 0, 0, 0
+
+
+def test_cache_is_read_only_when_needed(tmp_path, monkeypatch):
+    path = tmp_path / "cache"
+    text = f"0 1 0 0 0 {_FINGERPRINT}\ngarbage\n"
+    path.write_text(text)
+
+    with monkeypatch.context() as m:
+        m.setattr(statcache, "_read_entries", None)
+        cache = statcache.StatCache.load(path)
+        cache.put(_key(2), _FINGERPRINT)
+        cache.save()
+    assert path.read_text() == text + f"0 2 0 0 0 {_FINGERPRINT}\n"
+
+    cache = statcache.StatCache.load(path)
+    assert cache.get(_key(1)) == cache.get(_key(2)) == _FINGERPRINT
+
+
+def test_cache_appends_and_compacts(tmp_path):
+    path = tmp_path / "cache"
+    for ino in range(5):
+        cache = statcache.StatCache.load(path, max_size=2)
+        cache.put(_key(ino), _FINGERPRINT)
+        cache.save()
+        assert len(path.read_text().splitlines()) <= 4
+
+    cache = statcache.StatCache.load(path, max_size=2)
+    assert [cache.get(_key(ino)) for ino in range(5)] == 3 * [None] + 2 * [_FINGERPRINT]
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from conftest import File, Link, create_tree
+from lazylfs import walk
+
+_TREE = {
+    ".git": {"HEAD": File("ref: refs/heads/master")},
+    "a": {
+        "e": {"f": File("F"), "tmp": {"t": File("T")}},
+        "g": File("G"),
+        "mother": Link("../a/"),
+        "sister": Link("./e/"),
+        "nephew": Link("./e/f"),
+    },
+    "tmp": {"t": File("T")},
+}
+
+
+def _relative(top, entries):
+    return sorted(str(entry.path.relative_to(top)) for entry in entries)
+
+
+def test_walk_yields_same_paths_as_rglob_except_git(tmp_path):
+    create_tree(tmp_path, _TREE)
+    expected = sorted(
+        str(path.relative_to(tmp_path))
+        for path in tmp_path.rglob("*")
+        if ".git" not in path.relative_to(tmp_path).parts
+    )
+    assert _relative(tmp_path, walk.walk(tmp_path)) == expected
+
+
+def test_walk_prunes_excludes(tmp_path):
+    create_tree(tmp_path, _TREE)
+    actual = _relative(tmp_path, walk.walk(tmp_path, excludes=("tmp", "**/*ther")))
+    assert actual == [
+        "a",
+        "a/e",
+        "a/e/f",
+        "a/e/tmp",
+        "a/e/tmp/t",
+        "a/g",
+        "a/nephew",
+        "a/sister",
+    ]
+
+
+def test_walk_descends_into_each_directory_once(tmp_path):
+    create_tree(tmp_path, _TREE)
+    actual = _relative(tmp_path, walk.walk(tmp_path / "a", follow_symlinks=True))
+    # Either the directory or the link to it is descended into, but not both
+    assert len([path for path in actual if path.endswith("/f")]) == 1
+    assert len([path for path in actual if path.endswith("/g")]) == 1
+
+
+@pytest.mark.parametrize("name", ["g", "e", "mother", "nephew"])
+def test_entry_agrees_with_os(tmp_path, name):
+    create_tree(tmp_path, _TREE)
+    path = tmp_path / "a" / name
+    [from_walk] = [entry for entry in walk.walk(tmp_path / "a") if entry.name == name]
+    from_path = walk.as_entry(path)
+
+    for entry in [from_walk, from_path]:
+        assert entry.path == path
+        assert entry.is_symlink() == path.is_symlink()
+        assert entry.is_dir() == (path.is_dir() and not path.is_symlink())
+        assert entry.lstat() == os.lstat(path)
+
+
+def test_entry_for_missing_path(tmp_path):
+    entry = walk.as_entry(tmp_path / "missing")
+    assert not entry.is_symlink()
+    assert not entry.is_dir()
+    with pytest.raises(FileNotFoundError):
+        entry.lstat()